@@ -1,7 +1,7 @@
 import re
 from datetime import datetime, timedelta
 from itertools import groupby
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
@@ -12,7 +12,7 @@ from sqlalchemy.orm import Session
 from .config import Config
 from .database import Database
 from .logger import Logger
-from .models import Coin, CoinValue, CurrentCoin, Pair, ScoutHistory, Trade
+from .models import Coin, CoinValue, CurrentCoin, Pair, ScoutHistoryRollup, Trade
 
 app = Flask(__name__)
 cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -22,27 +22,34 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 
 logger = Logger("api_server")
 config = Config()
-db = Database(logger, config)
+db = Database(logger, config, cache_models=False, read_only=True)
 
 
-def filter_period(query, model):  # pylint: disable=inconsistent-return-statements
+def period_start() -> Optional[datetime]:  # pylint: disable=inconsistent-return-statements
     period = request.args.get("period", "all")
 
     if period == "all":
-        return query
+        return None
 
     num = float(re.search(r"(\d*)[shdwm]", "1d").group(1))
 
     if "s" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(seconds=num))
+        return datetime.now() - timedelta(seconds=num)
     if "h" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(hours=num))
+        return datetime.now() - timedelta(hours=num)
     if "d" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(days=num))
+        return datetime.now() - timedelta(days=num)
     if "w" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(weeks=num))
+        return datetime.now() - timedelta(weeks=num)
     if "m" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(days=28 * num))
+        return datetime.now() - timedelta(days=28 * num)
+
+
+def filter_period(query, model):
+    start = period_start()
+    if start is None:
+        return query
+    return query.filter(model.datetime >= start)
 
 
 @app.route("/api/value_history/<coin>")
@@ -94,18 +101,21 @@ def trade_history():
 def scouting_history():
     _current_coin = db.get_current_coin()
     coin = _current_coin.symbol if _current_coin is not None else None
+    if config.SCOUT_HISTORY_MODE != Config.SCOUT_HISTORY_MODE_COMPACT:
+        # the raw scouts are spread over the partitions of the period
+        return jsonify([scout.info() for scout in db.get_scout_history(coin, period_start())])
     session: Session
     with db.db_session() as session:
         query = (
-            session.query(ScoutHistory)
-            .join(ScoutHistory.pair)
+            session.query(ScoutHistoryRollup)
+            .join(ScoutHistoryRollup.pair)
             .filter(Pair.from_coin_id == coin)
-            .order_by(ScoutHistory.datetime.asc())
+            .order_by(ScoutHistoryRollup.datetime.asc())
         )
 
-        query = filter_period(query, ScoutHistory)
+        query = filter_period(query, ScoutHistoryRollup)
 
-        scouts: List[ScoutHistory] = query.all()
+        scouts = query.all()
         return jsonify([scout.info() for scout in scouts])
 
 
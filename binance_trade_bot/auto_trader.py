@@ -1,17 +1,20 @@
 import math
 from collections import defaultdict
+from collections.abc import Mapping
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import json
 import time
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql.expression import and_
 
 from .binance_api_manager import BinanceAPIManager
 from .config import Config
 from .database import Database, LogScout
 from .logger import Logger
 from .models import Coin, CoinValue, Pair
+from .ratio_scoring import RatioScoringEngine
 
 import colorama
 from colorama import Fore, Back, Style
@@ -33,6 +36,30 @@ class RatioDebug:
         return f"now: {self.from_coin_price_now} / {self.to_coin_price_now}, database: {self.from_coin_price_database} / {self.to_coin_price_database}"
 
 
+class RatioDebugView(Mapping):
+    """
+    Builds the RatioDebug of a pair only when it is looked up
+    """
+
+    def __init__(self, coin_price: float, candidate_prices: Dict[Pair, float]):
+        self.coin_price = coin_price
+        self.candidate_prices = candidate_prices
+
+    def __getitem__(self, pair: Pair) -> RatioDebug:
+        d = RatioDebug()
+        d.from_coin_price_now = self.coin_price
+        d.to_coin_price_now = self.candidate_prices[pair]
+        d.from_coin_price_database = pair.from_coin_price
+        d.to_coin_price_database = pair.to_coin_price
+        return d
+
+    def __iter__(self):
+        return iter(self.candidate_prices)
+
+    def __len__(self):
+        return len(self.candidate_prices)
+
+
 class AutoTrader:
     def __init__(self, binance_manager: BinanceAPIManager, database: Database, logger: Logger, config: Config):
         self.manager = binance_manager
@@ -40,6 +67,7 @@ class AutoTrader:
         self.logger = logger
         self.config = config
         self.failed_buy_order = False
+        self.scoring_engine = RatioScoringEngine(binance_manager, config)
 
         self.trailing_stop = None
         self.allow_trade = not self.config.TRAILING_STOP
@@ -200,52 +228,80 @@ class AutoTrader:
 
         session: Session
         with self.db.db_session() as session:
-            for pair in session.query(Pair).filter(Pair.to_coin == coin):
-                from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
+            pairs = session.query(Pair.id, Pair.from_coin_id).filter(Pair.to_coin_id == coin.symbol).all()
 
-                if from_coin_price is None:
-                    self.logger.info(
-                        "Skipping update for coin {} not found".format(pair.from_coin + self.config.BRIDGE)
-                    )
-                    continue
+        pair_ids, ratios, from_coin_prices = [], [], []
+        for pair_id, from_coin_symbol in pairs:
+            from_coin_price = self.manager.get_sell_price(from_coin_symbol + self.config.BRIDGE.symbol)
+
+            if from_coin_price is None:
+                self.logger.info(
+                    "Skipping update for coin {} not found".format(from_coin_symbol + self.config.BRIDGE.symbol)
+                )
+                continue
 
-                pair.ratio = from_coin_price / coin_price
-                pair.from_coin_price = from_coin_price
-                pair.to_coin_price = coin_price
+            pair_ids.append(pair_id)
+            ratios.append(from_coin_price / coin_price)
+            from_coin_prices.append(from_coin_price)
 
-    def initialize_trade_thresholds(self):
+        self.db.bulk_update_pair_ratios(pair_ids, ratios, from_coin_prices, [coin_price] * len(pair_ids))
+
+    def _get_uninitialized_pairs(self) -> Dict[str, List[Tuple[int, str]]]:
         """
-        Initialize the buying threshold of all the coins for trading between them
+        (id, to coin symbol) of the pairs between enabled coins that have no ratio yet, grouped by from coin symbol
         """
+        from_coin = aliased(Coin)
+        to_coin = aliased(Coin)
+        grouped_pairs = defaultdict(list)
         session: Session
         with self.db.db_session() as session:
-            pairs = session.query(Pair).filter(Pair.ratio.is_(None)).all()
-            grouped_pairs = defaultdict(list)
-            for pair in pairs:
-                if pair.from_coin.enabled and pair.to_coin.enabled:
-                    grouped_pairs[pair.from_coin.symbol].append(pair)
-            for from_coin_symbol, group in grouped_pairs.items():
-                self.logger.info(f"Initializing {from_coin_symbol} vs [{', '.join([p.to_coin.symbol for p in group])}]")
-                for pair in group:
-                    if pair.from_coin == self.config.BRIDGE:
-                        continue
-                    from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
-                    if from_coin_price is None:
-                        self.logger.info(
-                            "Skipping initializing {}, symbol not found".format(pair.from_coin + self.config.BRIDGE)
-                        )
-                        continue
+            for pair_id, from_coin_symbol, to_coin_symbol in (
+                session.query(Pair.id, Pair.from_coin_id, Pair.to_coin_id)
+                .join(from_coin, and_(Pair.from_coin_id == from_coin.symbol, from_coin.enabled.is_(True)))
+                .join(to_coin, and_(Pair.to_coin_id == to_coin.symbol, to_coin.enabled.is_(True)))
+                .filter(Pair.ratio.is_(None))
+            ):
+                grouped_pairs[from_coin_symbol].append((pair_id, to_coin_symbol))
+        return grouped_pairs
 
-                    to_coin_price = self.manager.get_buy_price(pair.to_coin + self.config.BRIDGE)
-                    if to_coin_price is None:
-                        self.logger.info(
-                            "Skipping initializing {}, symbol not found".format(pair.to_coin + self.config.BRIDGE)
-                        )
-                        continue
+    def initialize_trade_thresholds(self):
+        """
+        Initialize the buying threshold of all the coins for trading between them
+        """
+        sell_prices: Dict[str, Optional[float]] = {}
+        buy_prices: Dict[str, Optional[float]] = {}
+        pair_ids, ratios, from_coin_prices, to_coin_prices = [], [], [], []
+        for from_coin_symbol, group in self._get_uninitialized_pairs().items():
+            self.logger.info(f"Initializing {from_coin_symbol} vs [{', '.join([symbol for _, symbol in group])}]")
+            if from_coin_symbol == self.config.BRIDGE.symbol:
+                continue
+            for pair_id, to_coin_symbol in group:
+                if from_coin_symbol not in sell_prices:
+                    sell_prices[from_coin_symbol] = self.manager.get_sell_price(
+                        from_coin_symbol + self.config.BRIDGE.symbol
+                    )
+                from_coin_price = sell_prices[from_coin_symbol]
+                if from_coin_price is None:
+                    self.logger.info(
+                        "Skipping initializing {}, symbol not found".format(from_coin_symbol + self.config.BRIDGE.symbol)
+                    )
+                    continue
 
-                    pair.ratio = from_coin_price / to_coin_price
-                    pair.from_coin_price = from_coin_price
-                    pair.to_coin_price = to_coin_price
+                if to_coin_symbol not in buy_prices:
+                    buy_prices[to_coin_symbol] = self.manager.get_buy_price(to_coin_symbol + self.config.BRIDGE.symbol)
+                to_coin_price = buy_prices[to_coin_symbol]
+                if to_coin_price is None:
+                    self.logger.info(
+                        "Skipping initializing {}, symbol not found".format(to_coin_symbol + self.config.BRIDGE.symbol)
+                    )
+                    continue
+
+                pair_ids.append(pair_id)
+                ratios.append(from_coin_price / to_coin_price)
+                from_coin_prices.append(from_coin_price)
+                to_coin_prices.append(to_coin_price)
+
+        self.db.bulk_update_pair_ratios(pair_ids, ratios, from_coin_prices, to_coin_prices)
 
     def scout(self):
         """
@@ -253,6 +309,11 @@ class AutoTrader:
         """
         raise NotImplementedError()
 
+    def close(self):
+        """
+        Called on shutdown, write whatever is only kept in memory
+        """
+
 
     def _get_simulated_coin_price(self, coin_price, log: bool):
         if self.trailing_stop is not None:
@@ -272,101 +333,60 @@ class AutoTrader:
 
     def _get_ratios(self, coin: Coin, coin_price, excluded_coins: List[Coin] = []):
         """
-        Given a coin, get the current price ratio for every other enabled coin
+        Given a coin, get the current price ratio for every other enabled coin. The formulas are documented at
+        RatioScoringEngine._scores
         """
-        ratio_dict: Dict[Pair, float] = {}
-        prices: Dict[str, float] = {}
-        ratio_debug: Dict[Pair, RatioDebug] = {}
-
-        scout_logs = []
         excluded_coin_symbols = [c.symbol for c in excluded_coins]
-        for pair in self.db.get_pairs_from(coin):
-            #skip excluded coins
-            if pair.to_coin.symbol in excluded_coin_symbols:
-                continue
-
-            candidate_coin_price = self.manager.get_buy_price(pair.to_coin + self.config.BRIDGE)
-            prices[pair.to_coin_id] = candidate_coin_price
-
-            if candidate_coin_price is None:
-                self.logger.info("Skipping scouting... candidate coin {} not found".format(pair.to_coin + self.config.BRIDGE))
-                continue
-
-            scout_logs.append(LogScout(pair, pair.ratio, coin_price, candidate_coin_price))
-
-            # Obtain (current coin)/(optional coin)
-            current2possible_ratio = coin_price / candidate_coin_price
-
-            from_fee =        self.manager.get_fee(pair.from_coin, self.config.BRIDGE, True)
-            to_fee =          self.manager.get_fee(pair.to_coin,   self.config.BRIDGE, False)
-            transaction_fee = from_fee + to_fee - from_fee * to_fee
-
-            ######  Original formula:  #####
-            #
-            #   ((current2possible_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * current2possible_ratio) - pair.ratio)
-            #
-            #
-
-            ######  Normalized formula: #####
-            #
-            #   ((current2possible_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * current2possible_ratio) - pair.ratio) * 100 / pair.ratio
-            #   ((current2possible_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * current2possible_ratio) / pair.ratio - 1) * 100
-            #   ((1                      - transaction_fee * self.config.SCOUT_MULTIPLIER) * current2possible_ratio / pair.ratio - 1) * 100
-            #
-            #  short:
-            #
-            #   ((1 - transaction_fee * self.config.SCOUT_MULTIPLIER) * current2possible_ratio / pair.ratio - 1) * 100
-            #
-            #  from: https://github.com/edeng23/binance-trade-bot/issues/385
-            #
-
-            ######  Margin formula: #####
-            #
-            #   ((1 - transaction_fee) * current2possible_ratio / pair.ratio - 1) * 100 - self.config.SCOUT_MARGIN
-            #
-            #  from: https://github.com/edeng23/binance-trade-bot/pull/417/files#diff-d2579cf2f5170dacac5d1dbfa2ac255210dbd8fba50b28aa04cbee38aed1e9fbR138
-            #
-
-            if self.config.USE_MARGIN:
-                ratio_dict[pair] = ((1 - transaction_fee) * current2possible_ratio / pair.ratio - 1) * 100 - self.config.SCOUT_MARGIN
-            else:
-                ratio_dict[pair] = ((1 - transaction_fee * self.config.SCOUT_MULTIPLIER) * current2possible_ratio / pair.ratio - 1) * 100
+        scores = self.scoring_engine.score(coin, coin_price, self.db.get_pairs_from(coin), excluded_coin_symbols)
 
+        for pair in scores.missing:
+            self.logger.info("Skipping scouting... candidate coin {} not found".format(pair.to_coin + self.config.BRIDGE))
 
-            d = RatioDebug()
-            d.from_coin_price_now = coin_price
-            d.to_coin_price_now = candidate_coin_price
-            d.from_coin_price_database = pair.from_coin_price
-            d.to_coin_price_database = pair.to_coin_price
-            ratio_debug[pair] = d
+        candidate_prices: Dict[Pair, float] = dict(zip(scores.pairs, scores.prices.tolist()))
+        ratio_dict: Dict[Pair, float] = dict(zip(scores.pairs, scores.scores.tolist()))
+        prices: Dict[str, float] = {pair.to_coin_id: price for pair, price in candidate_prices.items()}
+        prices.update((pair.to_coin_id, None) for pair in scores.missing)
+        ratio_debug = RatioDebugView(coin_price, candidate_prices)
 
-
-        self.db.batch_log_scout(scout_logs)
+        self.db.batch_log_scout(
+            [LogScout(pair, pair.ratio, coin_price, price) for pair, price in candidate_prices.items()]
+        )
         return (ratio_dict, prices, ratio_debug)
 
 
-    def _get_jump_candidate_log(self, coin: Coin, coin_price: float, excluded_coins: List[Coin] = []):
-        ratio_dict_all, prices, ratio_debug = self._get_ratios(coin, self._get_simulated_coin_price(coin_price, False), excluded_coins)
+    def _log_scout(self, coin: Coin, coin_price: float, excluded_coins: List[Coin] = []):
+        """
+        Bring the candidate index of coin up to date and log the candidate prices to the scout history
+        """
+        index = self.scoring_engine.candidate_index(coin, self.db.get_pairs_from(coin))
+        candidates, missing = self.scoring_engine.candidate_prices(coin, index, [c.symbol for c in excluded_coins])
 
-        # keep only ratios bigger than zero
-        ratio_dict = {k: v for k, v in ratio_dict_all.items() if v > 0}
+        for pair in missing:
+            self.logger.info("Skipping scouting... candidate coin {} not found".format(pair.to_coin + self.config.BRIDGE))
 
-        # ratio_dict_str = json.dumps(ratio_dict)
-        # ratio_dict_all_str = json.dumps(ratio_dict_all)
-        # self.logger.info(f"ratios: {ratio_dict_all_str}\n")
+        self.db.batch_log_scout(
+            [LogScout(pair, ratio, coin_price, price) for pair, (ratio, price) in candidates.items()]
+        )
+        return index
 
-        ratio_dict_all_sorted = {k: v for k, v in sorted(ratio_dict_all.items(), key=lambda item: item[1])}
 
-#        self.logger.info(f"\n")
-        for f_pair, f_ratio in ratio_dict_all_sorted.items():
-#            self.logger.info(f"pair: {f_pair}, ratio: {f_ratio}")
-            True
+    def _get_jump_candidate_log(self, coin: Coin, coin_price: float, excluded_coins: List[Coin] = []):
+        simulated_coin_price = self._get_simulated_coin_price(coin_price, False)
+        index = self.scoring_engine.candidate_index(coin, self.db.get_pairs_from(coin))
+        best, worst = self.scoring_engine.ranked_candidates(
+            coin, simulated_coin_price, index, 4, 2, [c.symbol for c in excluded_coins]
+        )
+        best_candidates = list(zip(best.pairs, best.scores.tolist()))
+        worst_candidates = list(zip(worst.pairs, worst.scores.tolist()))
+        ratio_debug = RatioDebugView(
+            simulated_coin_price, dict(zip(best.pairs + worst.pairs, best.prices.tolist() + worst.prices.tolist()))
+        )
 
         if self.config.SCOUT_DEBUG:
             s = ""
             s += "best candidates: "
             sep = ""
-            for f_pair, f_ratio in reversed({k: ratio_dict_all_sorted[k] for k in list(ratio_dict_all_sorted)[-4:]}.items()):
+            for f_pair, f_ratio in best_candidates:
                 f_ratio_rounded = round(f_ratio, 5)
                 f_ratio_debug = ratio_debug[f_pair]
                 s += sep
@@ -375,7 +395,7 @@ class AutoTrader:
             s += ", "
             s += "worst candidates: "
             sep = ""
-            for f_pair, f_ratio in {k: ratio_dict_all_sorted[k] for k in list(ratio_dict_all_sorted)[:2]}.items():
+            for f_pair, f_ratio in worst_candidates:
                 f_ratio_rounded = round(f_ratio, 5)
                 f_ratio_debug = ratio_debug[f_pair]
                 s += sep
@@ -383,12 +403,12 @@ class AutoTrader:
                 sep = ", "
             s += "\n"
             s += "best candidates:\n"
-            for f_pair, f_ratio in reversed({k: ratio_dict_all_sorted[k] for k in list(ratio_dict_all_sorted)[-4:]}.items()):
+            for f_pair, f_ratio in best_candidates:
                 f_ratio_rounded = round(f_ratio, 5)
                 f_ratio_debug = ratio_debug[f_pair]
                 s += f"  - {f_pair.to_coin.symbol} ({f_ratio_rounded} [{f_ratio_debug}])\n"
             s += "worst candidates:\n"
-            for f_pair, f_ratio in {k: ratio_dict_all_sorted[k] for k in list(ratio_dict_all_sorted)[:2]}.items():
+            for f_pair, f_ratio in worst_candidates:
                 f_ratio_rounded = round(f_ratio, 5)
                 f_ratio_debug = ratio_debug[f_pair]
                 s += f"  - {f_pair.to_coin.symbol} ({f_ratio_rounded} [{f_ratio_debug}])\n"
@@ -396,7 +416,7 @@ class AutoTrader:
             s = ""
             s += "best candidates: "
             sep = ""
-            for f_pair, f_ratio in reversed({k: ratio_dict_all_sorted[k] for k in list(ratio_dict_all_sorted)[-4:]}.items()):
+            for f_pair, f_ratio in best_candidates:
                 f_ratio_rounded = round(f_ratio, 5)
                 s += sep
                 s += f"{f_pair.to_coin.symbol} ({f_ratio_rounded})"
@@ -404,7 +424,7 @@ class AutoTrader:
             s += ", "
             s += "worst candidates: "
             sep = ""
-            for f_pair, f_ratio in {k: ratio_dict_all_sorted[k] for k in list(ratio_dict_all_sorted)[:2]}.items():
+            for f_pair, f_ratio in worst_candidates:
                 f_ratio_rounded = round(f_ratio, 5)
                 s += sep
                 s += f"{f_pair.to_coin.symbol} ({f_ratio_rounded})"
@@ -430,11 +450,13 @@ class AutoTrader:
             self.logger.info(f"trailing stop timeout in: {str(self.trailing_stop_timeout - time.time()) + 's'}",
                              notification=False)
 
-        ratio_dict_all, prices, ratio_debug = self._get_ratios(coin, self._get_simulated_coin_price(coin_price, True),
-                                                               excluded_coins)
+        simulated_coin_price = self._get_simulated_coin_price(coin_price, True)
+        index = self._log_scout(coin, simulated_coin_price, excluded_coins)
 
-        # keep only ratios bigger than zero
-        ratio_dict = {k: v for k, v in ratio_dict_all.items() if v > 0}
+        # the best pair with a ratio bigger than zero, if any pair crossed its trigger price
+        best_candidate = self.scoring_engine.best_candidate(
+            coin, simulated_coin_price, index, [c.symbol for c in excluded_coins]
+        )
 
         stored_bridge_coin_on_funding_wallet = False
         if self.config.USE_FUNDING_WALLET:
@@ -446,9 +468,9 @@ class AutoTrader:
         if self.config.TRAILING_STOP and not stored_bridge_coin_on_funding_wallet:
 
             # if we have any viable options, pick the one with the biggest ratio
-            if ratio_dict:
+            if best_candidate is not None:
 
-                best_pair = max(ratio_dict, key=ratio_dict.get)
+                best_pair, best_pair_price, _ = best_candidate
 
                 self.logger.info(f"best pair = {best_pair}", notification=False)
 
@@ -483,7 +505,7 @@ class AutoTrader:
 
                 self.logger.info(f"Jumping from {coin} to <{best_pair.to_coin_id}>")
 
-                self.transaction_through_bridge(best_pair, coin_price, prices[best_pair.to_coin_id])
+                self.transaction_through_bridge(best_pair, coin_price, best_pair_price)
 
                 self.trailing_stop = None
                 self.allow_trade = not self.config.TRAILING_STOP
@@ -503,38 +525,59 @@ class AutoTrader:
         else: # if not self.config.TRAILING_STOP:
 
             # if we have any viable options, pick the one with the biggest ratio
-            if ratio_dict:
-                best_pair = max(ratio_dict, key=ratio_dict.get)
+            if best_candidate is not None:
+                best_pair, best_pair_price, _ = best_candidate
                 self.logger.info(f"best pair = {best_pair}", notification=False)
                 self.logger.info(f"Jumping from {coin} to <{best_pair.to_coin_id}>")
-                self.transaction_through_bridge(best_pair, coin_price, prices[best_pair.to_coin_id])
+                self.transaction_through_bridge(best_pair, coin_price, best_pair_price)
 
 
 
+    def _get_bridge_scout_targets(self, coins: List[Coin], excluded_coins: List[Coin] = []) -> List[Coin]:
+        """
+        The coins none of whose candidates (except excluded_coins) has a ratio bigger than zero, in the order of coins
+        """
+        priced_coins = []
+        coin_prices = []
+        for coin in coins:
+            coin_price = self.manager.get_sell_price(coin + self.config.BRIDGE)
+            if coin_price is not None:
+                priced_coins.append(coin)
+                coin_prices.append(coin_price)
+
+        targets = self.scoring_engine.bridge_scout_targets(
+            priced_coins,
+            coin_prices,
+            [self.db.get_pairs_from(coin) for coin in priced_coins],
+            [c.symbol for c in excluded_coins],
+        )
+        targets = [coin for coin, target in zip(priced_coins, targets.tolist()) if target]
+
+        # one line instead of a scout history entry for every pair of every coin
+        self.logger.info(
+            f"bridge scout: {len(targets)} of {len(priced_coins)} coins have no better candidate: "
+            f"{', '.join(coin.symbol for coin in targets)}",
+            notification=False,
+        )
+        return targets
+
     def bridge_scout(self):
         """
         If we have any bridge coin leftover, buy a coin with it that we won't immediately trade out of
         """
         bridge_balance = self.manager.get_currency_balance(self.config.BRIDGE.symbol)
 
-        for coin in self.db.get_coins():
-            current_coin_price = self.manager.get_sell_price(coin + self.config.BRIDGE)
-
-            if current_coin_price is None:
-                continue
-
-            ratio_dict, prices, ratio_debug = self._get_ratios(coin, current_coin_price)
-            if not any(v > 0 for v in ratio_dict.values()):
-                # There will only be one coin where all the ratios are negative. When we find it, buy it if we can
-                if coin.symbol != "BNB" and bridge_balance > self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol):
-                    self.logger.info(f"Will be purchasing {coin} using bridge coin")
-                    result = self.manager.buy_alt(coin, self.config.BRIDGE, self.manager.get_sell_price(coin + self.config.BRIDGE))
-                    if result is not None:
-                        self.db.set_current_coin(coin)
-                        self.failed_buy_order = False
-                        return coin
-                    else:
-                        self.failed_buy_order = True
+        for coin in self._get_bridge_scout_targets(self.db.get_coins()):
+            # There will only be one coin where all the ratios are negative. When we find it, buy it if we can
+            if coin.symbol != "BNB" and bridge_balance > self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol):
+                self.logger.info(f"Will be purchasing {coin} using bridge coin")
+                result = self.manager.buy_alt(coin, self.config.BRIDGE, self.manager.get_sell_price(coin + self.config.BRIDGE))
+                if result is not None:
+                    self.db.set_current_coin(coin)
+                    self.failed_buy_order = False
+                    return coin
+                else:
+                    self.failed_buy_order = True
         return None
 
     def update_values(self):
@@ -40,7 +40,7 @@ class MockBinanceManager(BinanceAPIManager):
     def now(self):
         return self.datetime.replace(tzinfo=timezone.utc)
 
-    def setup_websockets(self):
+    def setup_websockets(self, scout_trigger=None):
         pass  # No websockets are needed for backtesting
 
     def increment(self, interval=1):
@@ -52,6 +52,9 @@ class MockBinanceManager(BinanceAPIManager):
             
         return 0.001
 
+    def get_fees_version(self):
+        return 0  # fees never change while backtesting
+
     def get_min_notional(self, origin_symbol: str, target_symbol: str):
         return 10.0
 
@@ -88,6 +91,7 @@ class MockBinanceManager(BinanceAPIManager):
         fee = order_quantity * self.get_fee(origin_coin, target_coin, False)
         self.balances[target_symbol] -= target_quantity
         self.balances[origin_symbol] = self.balances.get(origin_symbol, 0) + order_quantity - fee
+        self.cache.balances_changed_event.set()
         if origin_symbol not in self.paid_fees.keys():
             self.paid_fees[origin_symbol] = 0
         self.paid_fees[origin_symbol] += fee
@@ -150,6 +154,7 @@ class MockBinanceManager(BinanceAPIManager):
             self.paid_fees[target_symbol] = 0
         self.paid_fees[target_symbol] += fee
         self.balances[origin_symbol] -= order_quantity
+        self.cache.balances_changed_event.set()
 
         self.logger.info(
             f"{self.datetime} Sold {origin_symbol} for {from_coin_price} {target_symbol}"
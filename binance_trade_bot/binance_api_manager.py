@@ -2,12 +2,14 @@ from datetime import datetime, timezone
 import json
 import math
 import os
+import threading
 import time
 import traceback
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from typing import Callable, Dict, Optional
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
 
+import numpy as np
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from cachetools import TTLCache, cached
@@ -18,6 +20,8 @@ from .config import Config
 from .database import Database
 from .logger import Logger
 from .models import Coin
+from .price_board import PRICE_ASK, PRICE_BID, PRICE_LAST
+from .scout_trigger import ScoutTrigger
 
 def float_as_decimal_str(num: float):
     return f"{num:0.08f}".rstrip("0").rstrip(".")  # remove trailing zeroes too
@@ -86,6 +90,10 @@ class BinanceOrderBalanceManager(AbstractOrderBalanceManager):
         """
         Get balance of a specific coin
         """
+        balance = self.cache.balances.get(currency_symbol, None)
+        if not force and balance is not None:
+            return balance
+
         with self.cache.open_balances() as cache_balances:
             balance = cache_balances.get(currency_symbol, None)
             if force or balance is None:
@@ -97,6 +105,7 @@ class BinanceOrderBalanceManager(AbstractOrderBalanceManager):
                     }
                 )
                 self.logger.debug(f"Fetched all balances: {cache_balances}")
+                self.cache.balances_changed_event.set()
                 if currency_symbol not in cache_balances:
                     cache_balances[currency_symbol] = 0.0
                     return 0.0
@@ -122,6 +131,21 @@ class BinanceAPIManager:
         self.order_balance_manager = order_balance_manager
         self.stream_manager: Optional[BinanceStreamManager] = None
 
+        # fee per (symbol, selling), see _validate_fees for when it's dropped
+        self._fees: Dict[Tuple[str, bool], float] = {}
+        self._fees_version = 0
+        self._fees_trade_fees: Optional[Dict[str, float]] = None
+        self._fees_using_bnb = None
+        self._fees_bnb_price: Optional[float] = None
+
+        # (column, symbol) -> price of the symbols the streams don't cover, see _get_unstreamed_price
+        self._unstreamed_prices = TTLCache(maxsize=1000, ttl=config.UNSTREAMED_PRICE_TTL)
+        self._unstreamed_prices_lock = threading.Lock()
+
+        # see _fetch_orderbook_tickers
+        self._orderbook_ticker_lock = threading.Lock()
+        self._orderbook_ticker_fetches = 0
+
     @staticmethod
     def _common_factory(
         config: Config,
@@ -163,13 +187,14 @@ class BinanceAPIManager:
     def now(self):
         return datetime.now(tz=timezone.utc)
 
-    def setup_websockets(self):
+    def setup_websockets(self, scout_trigger: Optional[ScoutTrigger] = None):
         self.stream_manager = BinanceStreamManager(
             self.cache,
             self.config,
             self.binance_client,
             self.db,
-            self.logger
+            self.logger,
+            scout_trigger,
         )
 
     @cached(cache=TTLCache(maxsize=1, ttl=43200))
@@ -180,10 +205,54 @@ class BinanceAPIManager:
     def get_using_bnb_for_fees(self):
         return self.binance_client.get_bnb_burn_spot_margin()["spotBNBBurn"]
 
+    def _validate_fees(self):
+        """
+        Drop the fee table when one of its inputs changed: the BNB balance (reported by the user data stream),
+        the BNB price (moved more than FEE_TABLE_BNB_PRICE_THRESHOLD), the trade fees or the BNB burn setting
+        """
+        trade_fees = self.get_trade_fees()
+        using_bnb_for_fees = self.get_using_bnb_for_fees()
+        bnb_price = self.cache.price_board.get(PRICE_LAST, "BNB" + self.config.BRIDGE.symbol)
+
+        stale = (
+            self.cache.bnb_balance_changed_event.is_set()
+            or trade_fees is not self._fees_trade_fees
+            or using_bnb_for_fees != self._fees_using_bnb
+        )
+        if not stale and bnb_price is not None:
+            if self._fees_bnb_price is None:
+                self._fees_bnb_price = bnb_price
+            stale = abs(bnb_price / self._fees_bnb_price - 1) > self.config.FEE_TABLE_BNB_PRICE_THRESHOLD
+
+        if stale:
+            self.cache.bnb_balance_changed_event.clear()
+            self._fees.clear()
+            self._fees_version += 1
+            self._fees_trade_fees = trade_fees
+            self._fees_using_bnb = using_bnb_for_fees
+            self._fees_bnb_price = bnb_price
+
+    def get_fees_version(self) -> int:
+        """
+        Changes whenever fees returned by get_fee may have changed, so callers can keep their own copies
+        """
+        if self.config.TRADE_FEE == "auto":
+            self._validate_fees()
+        return self._fees_version
+
     def get_fee(self, origin_coin: Coin, target_coin: Coin, selling: bool):
         if self.config.TRADE_FEE != "auto":
             return float(self.config.TRADE_FEE)
 
+        self._validate_fees()
+        key = (origin_coin + target_coin, selling)
+        fee = self._fees.get(key, None)
+        if fee is None:
+            fee = self._calculate_fee(origin_coin, target_coin, selling)
+            self._fees[key] = fee
+        return fee
+
+    def _calculate_fee(self, origin_coin: Coin, target_coin: Coin, selling: bool):
         base_fee = self.get_trade_fees()[origin_coin + target_coin]
         if not self.get_using_bnb_for_fees():
             return base_fee
@@ -259,62 +328,136 @@ class BinanceAPIManager:
         else:
             return self.get_ticker_price(ticker_symbol)
 
+    def get_price_board_slot(self, ticker_symbol: str) -> int:
+        return self.cache.price_board.slot(ticker_symbol)
+
+    def get_price_board_sequence(self) -> int:
+        """
+        Changes whenever the prices on the price board may have changed
+        """
+        return self.cache.price_board.sequence
+
+    def get_buy_prices(self, board_slots: np.ndarray) -> np.ndarray:
+        """
+        Buy prices of the price board slots from one consistent snapshot, nan where the price isn't known yet
+        """
+        column = PRICE_ASK if self.config.PRICE_TYPE == Config.PRICE_TYPE_ORDERBOOK else PRICE_LAST
+        return self.cache.price_board.read(column, board_slots)
+
+    def get_sell_prices(self, board_slots: np.ndarray) -> np.ndarray:
+        """
+        Sell prices of the price board slots from one consistent snapshot, nan where the price isn't known yet
+        """
+        column = PRICE_BID if self.config.PRICE_TYPE == Config.PRICE_TYPE_ORDERBOOK else PRICE_LAST
+        return self.cache.price_board.read(column, board_slots)
+
     def get_ticker_price(self, ticker_symbol: str):
         """
         Get ticker price of a specific coin
         """
-        price = self.cache.ticker_values.get(ticker_symbol, None)
+        board = self.cache.price_board
+        price = board.get(PRICE_LAST, ticker_symbol)
         if price is None and ticker_symbol not in self.cache.non_existent_tickers:
-            self.cache.ticker_values = {
-                ticker["symbol"]: float(ticker["price"]) for ticker in self.binance_client.get_symbol_ticker()
-            }
-            self.logger.debug(f"Fetched all ticker prices: {self.cache.ticker_values}")
-            price = self.cache.ticker_values.get(ticker_symbol, None)
+            market_symbols = self.stream_manager.market_symbols if self.stream_manager is not None else ()
+            if ticker_symbol in market_symbols:
+                tickers = self.binance_client.get_symbol_ticker()
+                with board.write():
+                    for ticker in tickers:
+                        # prices of other symbols would never be updated again
+                        if ticker["symbol"] in market_symbols:
+                            board.set_last(board.slot(ticker["symbol"]), float(ticker["price"]))
+                self.logger.debug(f"Fetched all {len(tickers)} ticker prices")
+                price = board.get(PRICE_LAST, ticker_symbol)
+            else:
+                price = self._get_unstreamed_price(
+                    PRICE_LAST,
+                    ticker_symbol,
+                    lambda: {PRICE_LAST: float(self.binance_client.get_symbol_ticker(symbol=ticker_symbol)["price"])},
+                )
             if price is None:
                 self.logger.info(f"Ticker does not exist: {ticker_symbol} - will not be fetched from now on", notification=False)
                 self.cache.non_existent_tickers.add(ticker_symbol)
 
         return price
 
-    def get_ask_price(self, ticker_symbol: str):
+    def _get_unstreamed_price(
+        self, column: str, ticker_symbol: str, fetch: Callable[[], Dict[str, float]]
+    ) -> Optional[float]:
         """
-        Get best ask price of a specific coin
+        Price of a symbol the streams don't keep up to date, fetched with fetch, which returns the prices per column
+        of the symbol, and kept for unstreamed_price_ttl seconds. None if the symbol doesn't exist
         """
-        price = self.cache.ticker_values_ask.get(ticker_symbol, None)
-        if price is None and ticker_symbol not in self.cache.non_existent_tickers:
+        with self._unstreamed_prices_lock:
+            price = self._unstreamed_prices.get((column, ticker_symbol))
+        if price is None:
             try:
-                ticker = self.binance_client.get_orderbook_ticker(symbol = ticker_symbol)
-                price = float(ticker['askPrice'])
+                prices = fetch()
             except BinanceAPIException as e:
-                if e.code == -1121: # invalid symbol
-                    price = None
-                else:
-                    raise e
+                if e.code == -1121:  # invalid symbol
+                    return None
+                raise e
+            with self._unstreamed_prices_lock:
+                for fetched_column, fetched_price in prices.items():
+                    self._unstreamed_prices[(fetched_column, ticker_symbol)] = fetched_price
+            price = prices[column]
+        return price
+
+    def _fetch_orderbook_tickers(self, book_ticker_symbols: FrozenSet[str]):
+        """
+        Fill the bid and ask prices the price board doesn't know yet of the symbols the bookTicker streams keep up
+        to date, with the order book tickers of all symbols, one request. Misses that come in while it runs wait for
+        it and use its result instead of fetching again
+        """
+        fetches = self._orderbook_ticker_fetches
+        with self._orderbook_ticker_lock:
+            if self._orderbook_ticker_fetches != fetches:
+                return
+            tickers = self.binance_client.get_orderbook_tickers()
+            board = self.cache.price_board
+            with board.write():
+                for ticker in tickers:
+                    # prices of other symbols would never be updated again
+                    if ticker["symbol"] not in book_ticker_symbols:
+                        continue
+                    slot = board.slot(ticker["symbol"])
+                    # the streams may have brought newer ones meanwhile
+                    if board.bid[slot] != board.bid[slot]:
+                        board.set_book(slot, float(ticker["bidPrice"]), float(ticker["askPrice"]))
+            self._orderbook_ticker_fetches += 1
+            self.logger.debug(f"Fetched all {len(tickers)} order book tickers")
+
+    def _fetch_orderbook_ticker(self, ticker_symbol: str) -> Dict[str, float]:
+        ticker = self.binance_client.get_orderbook_ticker(symbol=ticker_symbol)
+        return {PRICE_BID: float(ticker["bidPrice"]), PRICE_ASK: float(ticker["askPrice"])}
+
+    def _get_orderbook_price(self, column: str, ticker_symbol: str):
+        price = self.cache.price_board.get(column, ticker_symbol)
+        if price is None and ticker_symbol not in self.cache.non_existent_tickers:
+            book_ticker_symbols = self.stream_manager.book_ticker_symbols if self.stream_manager is not None else ()
+            if ticker_symbol in book_ticker_symbols:
+                self._fetch_orderbook_tickers(book_ticker_symbols)
+                price = self.cache.price_board.get(column, ticker_symbol)
+            else:
+                price = self._get_unstreamed_price(
+                    column, ticker_symbol, lambda: self._fetch_orderbook_ticker(ticker_symbol)
+                )
             if price is None:
                 self.logger.info(f"Ticker does not exist: {ticker_symbol} - will not be fetched from now on")
                 self.cache.non_existent_tickers.add(ticker_symbol)
 
         return price
 
+    def get_ask_price(self, ticker_symbol: str):
+        """
+        Get best ask price of a specific coin
+        """
+        return self._get_orderbook_price(PRICE_ASK, ticker_symbol)
+
     def get_bid_price(self, ticker_symbol: str):
         """
         Get best bid price of a specific coin
         """
-        price = self.cache.ticker_values_bid.get(ticker_symbol, None)
-        if price is None and ticker_symbol not in self.cache.non_existent_tickers:
-            try:
-                ticker = self.binance_client.get_orderbook_ticker(symbol = ticker_symbol)
-                price = float(ticker['bidPrice'])
-            except BinanceAPIException as e:
-                if e.code == -1121: # invalid symbol
-                    price = None
-                else:
-                    raise e
-            if price is None:
-                self.logger.info(f"Ticker does not exist: {ticker_symbol} - will not be fetched from now on")
-                self.cache.non_existent_tickers.add(ticker_symbol)
-        
-        return price
+        return self._get_orderbook_price(PRICE_BID, ticker_symbol)
 
     def get_currency_balance(self, currency_symbol: str, force=False) -> float:
         """
@@ -497,6 +640,28 @@ class BinanceAPIManager:
     def float_as_decimal_str(num: float):
         return f"{num:0.08f}".rstrip("0").rstrip(".")  # remove trailing zeroes too    
 
+    def _wait_for_new_balance(self, currency_symbol: str, version: int, is_new: Callable[[float], bool]) -> float:
+        """
+        Wait for the balance a trade left, which is_new tells apart from the one before it. The user data stream
+        reports it as a version of the balance after the one from before the trade. If it doesn't within
+        balance_update_timeout, the balance is fetched once instead and taken as it is
+        """
+        balance = self.get_currency_balance(currency_symbol)
+        deadline = time.monotonic() + self.config.BALANCE_UPDATE_TIMEOUT
+        while not is_new(balance):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.cache.wait_for_balance_version(currency_symbol, version + 1, remaining):
+                balance = self.get_currency_balance(currency_symbol, True)
+                if not is_new(balance):
+                    self.logger.warning(
+                        f"The {currency_symbol} balance didn't change within {self.config.BALANCE_UPDATE_TIMEOUT}s "
+                        f"after the trade, continuing with {balance} {currency_symbol}"
+                    )
+                break
+            version = self.cache.balance_versions.get(currency_symbol, 0)
+            balance = self.get_currency_balance(currency_symbol)
+        return balance
+
     def _buy_alt(self, origin_coin: Coin, target_coin: Coin, buy_price: float, buy_quantity: float=None):  # pylint: disable=too-many-locals
         """
         Buy altcoin
@@ -507,9 +672,7 @@ class BinanceAPIManager:
         origin_symbol = origin_coin.symbol
         target_symbol = target_coin.symbol
 
-        with self.cache.open_balances() as balances:
-            balances.clear()
-
+        origin_balance_version = self.cache.balance_versions.get(origin_symbol, 0)
         origin_balance = self.get_currency_balance(origin_symbol)
         target_balance = self.get_currency_balance(target_symbol)
         from_coin_price = self.get_buy_price(origin_symbol + target_symbol)
@@ -558,6 +721,8 @@ class BinanceAPIManager:
         if order is None:
             return None
 
+        self._wait_for_new_balance(origin_symbol, origin_balance_version, lambda balance: balance > origin_balance)
+
         if not order.price:
             order.price = order.cumulative_quote_qty/order_quantity
 
@@ -583,10 +748,7 @@ class BinanceAPIManager:
         origin_symbol = origin_coin.symbol
         target_symbol = target_coin.symbol
 
-        # get fresh balances
-        with self.cache.open_balances() as balances:
-            balances.clear()
-
+        origin_balance_version = self.cache.balance_versions.get(origin_symbol, 0)
         origin_balance = self.get_currency_balance(origin_symbol)
         target_balance = self.get_currency_balance(target_symbol)
         from_coin_price = self.get_sell_price(origin_symbol + target_symbol)
@@ -631,9 +793,7 @@ class BinanceAPIManager:
         if order is None:
             return None
 
-        new_balance = self.get_currency_balance(origin_symbol)
-        while new_balance >= origin_balance:
-            new_balance = self.get_currency_balance(origin_symbol, True)
+        self._wait_for_new_balance(origin_symbol, origin_balance_version, lambda balance: balance < origin_balance)
 
         if not order.price:
             order.price = order.cumulative_quote_qty / order_quantity
@@ -734,6 +894,8 @@ class PaperOrderBalanceManager(AbstractOrderBalanceManager):
             self.balances[self.bridge] = self.get_currency_balance(self.bridge) - quote_quantity
             self.balances[symbol_base] = self.get_currency_balance(symbol_base) + quantity * (1 - fees)
         self.cache.balances_changed_event.set()
+        if "BNB" in (symbol_base, self.bridge):
+            self.cache.bnb_balance_changed_event.set()
         super().make_order(side, symbol, quantity, quote_quantity, price)
         if side == Client.SIDE_BUY:
             # we do it only after buy for transaction speed
@@ -1,10 +1,9 @@
 
-import asyncio
-import sys
 import threading
 import time
-from contextlib import asynccontextmanager, contextmanager
-from typing import Dict, Set, Tuple, Optional
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Mapping, Set, Tuple, Optional
 
 import binance.client
 from binance.exceptions import BinanceAPIException, BinanceRequestException
@@ -13,39 +12,18 @@ from unicorn_binance_websocket_api import BinanceWebSocketApiManager
 from .config import Config
 from .database import Database
 from .logger import Logger
+from .price_board import PriceBoard
+from .scout_trigger import ScoutTrigger
+from .stream_event_queue import STREAM_SIGNAL, StreamEventQueue
 
-class ThreadSafeAsyncLock:
-    def __init__(self):
-        self._init_lock = threading.Lock()
-        self._async_lock: Optional[asyncio.Lock] = None
-        self.loop: Optional[asyncio.AbstractEventLoop] = None
-
-    def attach_loop(self):
-        with self._init_lock:
-            self._async_lock = asyncio.Lock()
-            self.loop = asyncio.get_running_loop()
-
-    def acquire(self):
-        self.__enter__()
-
-    def release(self):
-        self.__exit__(None, None, None)
-
-    def __enter__(self):
-        self._init_lock.__enter__()
-        if self._async_lock is not None:
-            asyncio.run_coroutine_threadsafe(self._async_lock.__aenter__(), self.loop).result()
+# name of the buffer of the user data stream, its events are routed to their own lane
+USER_DATA_STREAM_BUFFER = "user_data"
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._async_lock is not None:
-            asyncio.run_coroutine_threadsafe(self._async_lock.__aexit__(exc_type, exc_val, exc_tb), self.loop).result()
-        self._init_lock.__exit__(exc_type, exc_val, exc_tb)
-
-    async def __aenter__(self):
-        await self._async_lock.__aenter__()
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self._async_lock.__aexit__(exc_type, exc_val, exc_tb)
 
 class BinanceOrder:  # pylint: disable=too-few-public-methods
     def __init__(self, report):
@@ -66,27 +44,43 @@ class BinanceOrder:  # pylint: disable=too-few-public-methods
 
 class BinanceCache:  # pylint: disable=too-few-public-methods
     def __init__(self):
-        self.ticker_values: Dict[str, float] = {}
-        self.ticker_values_ask: Dict[str, float] = {}
-        self.ticker_values_bid: Dict[str, float] = {}
-        self._balances: Dict[str, float] = {}
-        self._balances_mutex: ThreadSafeAsyncLock = ThreadSafeAsyncLock()
+        self.price_board = PriceBoard()
+        # read only snapshots of the balances and of how often each one changed, never changed but replaced as a
+        # whole by open_balances
+        self.balances: Mapping[str, float] = MappingProxyType({})
+        self.balance_versions: Mapping[str, int] = MappingProxyType({})
+        self._balances_changed = threading.Condition()
         self.non_existent_tickers: Set[str] = set()
         self.balances_changed_event = threading.Event()
+        self.bnb_balance_changed_event = threading.Event()
         self.orders: Dict[str, BinanceOrder] = {}
 
-    def attach_loop(self):
-        self._balances_mutex.attach_loop()
-
     @contextmanager
     def open_balances(self):
-        with self._balances_mutex:
-            yield self._balances
-
-    @asynccontextmanager
-    async def open_balances_async(self):
-        async with self._balances_mutex:
-            yield self._balances
+        """
+        Change the balances: yields a copy of the current ones that is published as the new snapshot at the end,
+        with the version of every balance that changed bumped. Writers take turns, readers keep using the previous
+        snapshot meanwhile and never wait
+        """
+        with self._balances_changed:
+            old_balances = self.balances
+            balances = dict(old_balances)
+            yield balances
+            versions = dict(self.balance_versions)
+            for asset in old_balances.keys() | balances.keys():
+                if balances.get(asset) != old_balances.get(asset):
+                    versions[asset] = versions.get(asset, 0) + 1
+            # balances first, so whoever reads a version and then the balance gets at least that version of it
+            self.balances = MappingProxyType(balances)
+            self.balance_versions = MappingProxyType(versions)
+            self._balances_changed.notify_all()
+
+    def wait_for_balance_version(self, asset: str, version: int, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the balance of the asset reached the version, False if the timeout passed first
+        """
+        with self._balances_changed:
+            return self._balances_changed.wait_for(lambda: self.balance_versions.get(asset, 0) >= version, timeout)
 
 
 class OrderGuard:
@@ -114,21 +108,58 @@ class OrderGuard:
 
 
 class BinanceStreamManager:
-    def __init__(self, cache: BinanceCache, config: Config, binance_client: binance.client.Client, db: Database, logger: Logger):
+    def __init__(
+        self,
+        cache: BinanceCache,
+        config: Config,
+        binance_client: binance.client.Client,
+        db: Database,
+        logger: Logger,
+        scout_trigger: Optional[ScoutTrigger] = None,
+    ):
         self.cache = cache
         self.db = db
         self.logger = logger
+        # only the prices the scout actually uses may trigger it
+        self.ticker_scout_trigger = scout_trigger if config.PRICE_TYPE == Config.PRICE_TYPE_TICKER else None
+        self.book_scout_trigger = scout_trigger if config.PRICE_TYPE == Config.PRICE_TYPE_ORDERBOOK else None
+        # the streams hand their data and signals over through the queues, the processors sleep until they arrive.
+        # Order and balance updates have their own lane, so they never wait behind a backlog of market data
+        self.market_data_queue = StreamEventQueue()
+        self.user_data_queue = StreamEventQueue()
         self.bw_api_manager = BinanceWebSocketApiManager(
-            output_default="UnicornFy", enable_stream_signal_buffer=True, exchange=f"binance.{config.BINANCE_TLD}"
-        )
-        self.bw_api_manager.create_stream(
-            ["arr"], ["!miniTicker"], api_key=config.BINANCE_API_KEY, api_secret=config.BINANCE_API_SECRET_KEY
+            process_stream_data=self._put_stream_data,
+            process_stream_signals=self.user_data_queue.put_signal,
+            output_default="UnicornFy",
+            exchange=f"binance.{config.BINANCE_TLD}",
         )
+        # market data is parsed by _process_raw_market_data, only the user data needs UnicornFy
+        market_data_output = "raw_data" if config.MARKET_DATA_PARSER == Config.MARKET_DATA_PARSER_RAW else False
+        # the prices of all the other symbols are dropped before they are parsed
+        self.market_symbols = self._get_market_symbols(config)
+        if 1 < len(self.market_symbols) <= config.MARKET_DATA_MAX_SYMBOL_STREAMS:
+            self.bw_api_manager.create_stream(
+                ["miniTicker"], [symbol.lower() for symbol in sorted(self.market_symbols)], output=market_data_output
+            )
+        else:
+            self.bw_api_manager.create_stream(
+                ["arr"],
+                ["!miniTicker"],
+                api_key=config.BINANCE_API_KEY,
+                api_secret=config.BINANCE_API_SECRET_KEY,
+                output=market_data_output,
+            )
         self.bw_api_manager.create_stream(
-            ["arr"], ["!userData"], api_key=config.BINANCE_API_KEY, api_secret=config.BINANCE_API_SECRET_KEY
+            ["arr"],
+            ["!userData"],
+            api_key=config.BINANCE_API_KEY,
+            api_secret=config.BINANCE_API_SECRET_KEY,
+            stream_buffer_name=USER_DATA_STREAM_BUFFER,
         )
 
 
+        # the symbols whose bid and ask prices the streams keep up to date
+        self.book_ticker_symbols: FrozenSet[str] = frozenset()
         if config.PRICE_TYPE == Config.PRICE_TYPE_ORDERBOOK:
 
             bridge_coin = config.BRIDGE_SYMBOL
@@ -138,14 +169,40 @@ class BinanceStreamManager:
                 coin_symbols.append(coin.symbol.lower() + bridge_coin.lower())
 
             self.bw_api_manager.create_stream(
-                ["bookTicker"], coin_symbols
+                ["bookTicker"], coin_symbols, output=market_data_output
             )
-            
+            self.book_ticker_symbols = frozenset(symbol.upper() for symbol in coin_symbols)
+
+        # the newest prices of the current batch of stream events, symbol -> (price, event time) and
+        # symbol -> (ask, bid)
+        self._batch_tickers: Dict[str, Tuple[str, int]] = {}
+        self._batch_book_tickers: Dict[str, Tuple[str, str]] = {}
+        # price updates that were replaced by a newer one of the same symbol before they reached the cache
+        self.conflated_updates = 0
+        self._reported_conflated_updates = 0
+
         self.binance_client = binance_client
         self.pending_orders: Set[Tuple[str, int]] = set()
         self.pending_orders_mutex: threading.Lock = threading.Lock()
-        self._processorThread = threading.Thread(target=self._stream_processor)
-        self._processorThread.start()
+        self._processor_threads = [
+            threading.Thread(target=self._user_data_processor, name="user_data_processor"),
+            threading.Thread(target=self._market_data_processor, name="market_data_processor"),
+        ]
+        for thread in self._processor_threads:
+            thread.start()
+
+    def _get_market_symbols(self, config: Config) -> FrozenSet[str]:
+        """
+        The symbols the bot reads the prices of: its coins, BNB and BTC against the bridge, and against BNB and BTC
+        for the fees and the value history. Some of them don't exist on the exchange, they just never get a price.
+        They are picked once, when the streams start: the coins are set before that and never change while the bot
+        runs. Prices of any other symbol are fetched from the API, see BinanceAPIManager._get_unstreamed_price
+        """
+        quote_symbols = {config.BRIDGE_SYMBOL, "BNB", "BTC"}
+        base_symbols = {coin.symbol for coin in self.db.get_coins(only_enabled=False)}
+        base_symbols.update(config.SUPPORTED_COIN_LIST)
+        base_symbols.update(quote_symbols)
+        return frozenset(base + quote for base in base_symbols for quote in quote_symbols if base != quote)
 
     def acquire_order_guard(self):
         return OrderGuard(self.pending_orders, self.pending_orders_mutex)
@@ -163,6 +220,8 @@ class BinanceStreamManager:
                     self.logger.error(f"Got exception during fetching pending order: {e}")
                 if order is not None:
                     break
+                if self.user_data_queue.closed:
+                    return
                 time.sleep(1)
             fake_report = {
                 "symbol": order["symbol"],
@@ -181,28 +240,45 @@ class BinanceStreamManager:
     def _invalidate_balances(self):
         with self.cache.open_balances() as balances:
             balances.clear()
+        self.cache.balances_changed_event.set()
+        self.cache.bnb_balance_changed_event.set()
+
+    def _put_stream_data(self, stream_data, stream_buffer_name=False):
+        if stream_buffer_name == USER_DATA_STREAM_BUFFER:
+            self.user_data_queue.put_data(stream_data)
+        else:
+            self.market_data_queue.put_data(stream_data)
 
-    def _stream_processor(self):
+    def _user_data_processor(self):
         while True:
-            if self.bw_api_manager.is_manager_stopping():
-                sys.exit()
-
-            stream_signal = self.bw_api_manager.pop_stream_signal_from_stream_signal_buffer()
-            stream_data = self.bw_api_manager.pop_stream_data_from_stream_buffer()
-
-            if stream_signal is not False:
-                signal_type = stream_signal["type"]
-                stream_id = stream_signal["stream_id"]
-                if signal_type == "CONNECT":
-                    stream_info = self.bw_api_manager.get_stream_info(stream_id)
-                    if "!userData" in stream_info["markets"]:
-                        self.logger.debug("Connect for userdata arrived", False)
-                        self._fetch_pending_orders()
-                        self._invalidate_balances()
-            if stream_data is not False and "event_type" in stream_data:
-                self._process_stream_data(stream_data)
-            if stream_data is False and stream_signal is False:
-                time.sleep(0.01)
+            events = self.user_data_queue.drain()
+            if events is None:
+                return
+            for kind, event in events:
+                if kind == STREAM_SIGNAL:
+                    self._process_stream_signal(event)
+                elif "event_type" in event:
+                    self._process_stream_data(event)
+
+    def _market_data_processor(self):
+        while True:
+            events = self.market_data_queue.drain()
+            if events is None:
+                return
+            for _, event in events:
+                if isinstance(event, str):
+                    self._process_raw_market_data(event)
+                elif "event_type" in event:
+                    self._process_stream_data(event)
+            self._apply_market_data()
+
+    def _process_stream_signal(self, stream_signal):
+        if stream_signal["type"] == "CONNECT":
+            stream_info = self.bw_api_manager.get_stream_info(stream_signal["stream_id"])
+            if "!userData" in stream_info["markets"]:
+                self.logger.debug("Connect for userdata arrived", False)
+                self._fetch_pending_orders()
+                self._invalidate_balances()
 
     def _process_stream_data(self, stream_data):
         event_type = stream_data["event_type"]
@@ -211,24 +287,94 @@ class BinanceStreamManager:
             order = BinanceOrder(stream_data)
             self.cache.orders[order.id] = order
         elif event_type == "balanceUpdate":  # !userData
+            # the outboundAccountPosition that follows every balance change brings the new balance
             self.logger.debug(f"Balance update: {stream_data}")
-            with self.cache.open_balances() as balances:
-                asset = stream_data["asset"]
-                if asset in balances:
-                    del balances[stream_data["asset"]]
         elif event_type in ("outboundAccountPosition", "outboundAccountInfo"):  # !userData
             self.logger.debug(f"{event_type}: {stream_data}")
             with self.cache.open_balances() as balances:
                 for bal in stream_data["balances"]:
                     balances[bal["asset"]] = float(bal["free"])
+                    if bal["asset"] == "BNB":
+                        self.cache.bnb_balance_changed_event.set()
+            self.cache.balances_changed_event.set()
         elif event_type == "24hrMiniTicker":
             for event in stream_data["data"]:
-                self.cache.ticker_values[event["symbol"]] = float(event["close_price"])
+                symbol = event["symbol"]
+                if symbol in self.market_symbols:
+                    self._add_ticker(symbol, event["close_price"], event["event_time"])
         elif event_type == "bookTicker":
-                self.cache.ticker_values_ask[stream_data["symbol"]] = float(stream_data["best_ask_price"])
-                self.cache.ticker_values_bid[stream_data["symbol"]] = float(stream_data["best_bid_price"])
+            self._add_book_ticker(stream_data["symbol"], stream_data["best_ask_price"], stream_data["best_bid_price"])
         else:
             self.logger.error(f"Unknown event type found: {event_type}\n{stream_data}")
 
+    def _process_raw_market_data(self, payload: str):
+        """
+        Read the prices straight from the JSON of the miniTicker and bookTicker streams, see
+        https://binance-docs.github.io/apidocs/spot/en/#all-market-mini-tickers-stream
+        """
+        message = json_loads(payload)
+        if isinstance(message, dict) and "stream" in message:
+            # streams with more than one subscription wrap their messages
+            message = message["data"]
+        if isinstance(message, list):
+            for event in message:
+                symbol = event["s"]
+                if symbol in self.market_symbols:
+                    self._add_ticker(symbol, event["c"], event["E"])
+        elif message.get("e") == "24hrMiniTicker":  # the streams of single symbols
+            self._add_ticker(message["s"], message["c"], message["E"])
+        elif "a" in message and "b" in message:  # bookTicker messages have no event type
+            self._add_book_ticker(message["s"], message["a"], message["b"])
+        elif "result" not in message:
+            self.logger.error(f"Unknown market data found: {payload}")
+
+    def _add_ticker(self, symbol: str, price: str, event_time: int):
+        if symbol in self._batch_tickers:
+            self.conflated_updates += 1
+        self._batch_tickers[symbol] = (price, event_time)
+
+    def _add_book_ticker(self, symbol: str, ask_price: str, bid_price: str):
+        if symbol in self._batch_book_tickers:
+            self.conflated_updates += 1
+        self._batch_book_tickers[symbol] = (ask_price, bid_price)
+
+    def _apply_market_data(self):
+        """
+        Write the newest price of every symbol of the batch to the cache, as one update of the price board. After
+        a stall the older prices of a backlog are never parsed nor written, the cache jumps straight to the current
+        ones
+        """
+        if self._batch_tickers or self._batch_book_tickers:
+            with self.cache.price_board.write():
+                for symbol, (price, event_time) in self._batch_tickers.items():
+                    self._update_ticker(symbol, float(price), event_time)
+                for symbol, (ask_price, bid_price) in self._batch_book_tickers.items():
+                    self._update_book_ticker(symbol, float(ask_price), float(bid_price))
+        self._batch_tickers.clear()
+        self._batch_book_tickers.clear()
+        if self.conflated_updates != self._reported_conflated_updates:
+            self.logger.debug(f"Conflated price updates so far: {self.conflated_updates}", False)
+            self._reported_conflated_updates = self.conflated_updates
+
+    def _update_ticker(self, symbol: str, price: float, event_time: int):
+        board = self.cache.price_board
+        slot = board.slot(symbol)
+        if self.ticker_scout_trigger is not None and board.last[slot] != price:
+            self.ticker_scout_trigger.price_changed(symbol)
+        board.set_last(slot, price, event_time)
+
+    def _update_book_ticker(self, symbol: str, ask_price: float, bid_price: float):
+        board = self.cache.price_board
+        slot = board.slot(symbol)
+        if self.book_scout_trigger is not None and (board.ask[slot] != ask_price or board.bid[slot] != bid_price):
+            self.book_scout_trigger.price_changed(symbol)
+        # bookTicker messages carry no event time
+        board.set_book(slot, bid_price, ask_price)
+
     def close(self):
+        self.user_data_queue.close()
+        self.market_data_queue.close()
         self.bw_api_manager.stop_manager_with_all_streams()
+        for thread in self._processor_threads:
+            if thread is not threading.current_thread():
+                thread.join()
@@ -16,6 +16,15 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
     PRICE_TYPE_ORDERBOOK = "orderbook"
     PRICE_TYPE_TICKER = "ticker"
 
+    MARKET_DATA_PARSER_RAW = "raw"
+    MARKET_DATA_PARSER_UNICORNFY = "unicornfy"
+
+    SCOUT_MODE_INTERVAL = "interval"
+    SCOUT_MODE_EVENT = "event"
+
+    SCOUT_HISTORY_MODE_RAW = "raw"
+    SCOUT_HISTORY_MODE_COMPACT = "compact"
+
     def __init__(self):
         # Init config
         config = configparser.ConfigParser()
@@ -24,11 +33,25 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             "scout_multiplier": "5",
             "scout_margin": "0.8",
             "scout_sleep_time": "5",
+            "scout_mode": self.SCOUT_MODE_INTERVAL,
+            "scout_debounce": "0.1",
+            "scout_max_rate": "2",
             "scout_debug":"true",
             "use_margin":"true",
             "hourToKeepScoutHistory": "1",
+            "scout_history_queue_size": "100000",
+            "scout_history_flush_interval": "1",
+            "scout_history_mode": self.SCOUT_HISTORY_MODE_RAW,
+            "scout_history_raw_minutes": "10",
+            "scout_history_partition_minutes": "60",
+            "sqlite_journal_mode": "wal",
+            "sqlite_synchronous": "normal",
+            "sqlite_mmap_size": "268435456",
+            "sqlite_busy_timeout": "30",
+            "sqlite_maintenance_minutes": "60",
             "tld": "com",
             "trade_fee": "auto",
+            "fee_table_bnb_price_threshold": "0.01",
             "strategy": "default",
             "enable_paper_trading": "false",
             "sell_timeout": "0",
@@ -37,10 +60,17 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             "buy_order_type": self.ORDER_TYPE_LIMIT,
             "sell_max_price_change": "0.005",
             "buy_max_price_change": "0.005",
+            "balance_update_timeout": "10",
             "price_type": self.PRICE_TYPE_ORDERBOOK,
+            "market_data_parser": self.MARKET_DATA_PARSER_UNICORNFY,
+            "market_data_max_symbol_streams": "300",
+            "unstreamed_price_ttl": "5",
             "accept_losses": "false",
             "max_idle_hours": "3",
             "ratio_adjust_weight": "100",
+            "ratio_adjust_flush_minutes": "5",
+            "ratio_adjust_init_threads": "8",
+            "ratio_adjust_init_weight_budget": "600",
             "auto_adjust_bnb_balance": "false",
             "auto_adjust_bnb_balance_rate": "3",
             "trailing_stop": "true",
@@ -75,6 +105,61 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
         self.SCOUT_HISTORY_PRUNE_TIME = float(
             os.environ.get("HOURS_TO_KEEP_SCOUTING_HISTORY") or config.get(USER_CFG_SECTION, "hourToKeepScoutHistory")
         )
+        self.SCOUT_HISTORY_QUEUE_SIZE = int(
+            os.environ.get("SCOUT_HISTORY_QUEUE_SIZE") or config.get(USER_CFG_SECTION, "scout_history_queue_size")
+        )
+        self.SCOUT_HISTORY_FLUSH_INTERVAL = float(
+            os.environ.get("SCOUT_HISTORY_FLUSH_INTERVAL")
+            or config.get(USER_CFG_SECTION, "scout_history_flush_interval")
+        )
+
+        scout_history_modes = {
+            self.SCOUT_HISTORY_MODE_RAW,
+            self.SCOUT_HISTORY_MODE_COMPACT,
+        }
+        scout_history_mode = os.environ.get("SCOUT_HISTORY_MODE") or config.get(USER_CFG_SECTION, "scout_history_mode")
+        if scout_history_mode not in scout_history_modes:
+            raise Exception(
+                f"{self.SCOUT_HISTORY_MODE_RAW} or {self.SCOUT_HISTORY_MODE_COMPACT} expected, got {scout_history_mode} for scout_history_mode"
+            )
+        self.SCOUT_HISTORY_MODE = scout_history_mode
+        self.SCOUT_HISTORY_RAW_MINUTES = float(
+            os.environ.get("SCOUT_HISTORY_RAW_MINUTES") or config.get(USER_CFG_SECTION, "scout_history_raw_minutes")
+        )
+        self.SCOUT_HISTORY_PARTITION_MINUTES = float(
+            os.environ.get("SCOUT_HISTORY_PARTITION_MINUTES")
+            or config.get(USER_CFG_SECTION, "scout_history_partition_minutes")
+        )
+
+        # SQLite engine profile, shared by the bot and the api server
+        sqlite_journal_modes = {"delete", "truncate", "persist", "memory", "wal", "off"}
+        sqlite_journal_mode = (
+            os.environ.get("SQLITE_JOURNAL_MODE") or config.get(USER_CFG_SECTION, "sqlite_journal_mode")
+        ).lower()
+        if sqlite_journal_mode not in sqlite_journal_modes:
+            raise Exception(
+                f"One of {', '.join(sorted(sqlite_journal_modes))} expected, got {sqlite_journal_mode} for sqlite_journal_mode"
+            )
+        self.SQLITE_JOURNAL_MODE = sqlite_journal_mode
+
+        sqlite_synchronous_levels = {"off", "normal", "full", "extra"}
+        sqlite_synchronous = (
+            os.environ.get("SQLITE_SYNCHRONOUS") or config.get(USER_CFG_SECTION, "sqlite_synchronous")
+        ).lower()
+        if sqlite_synchronous not in sqlite_synchronous_levels:
+            raise Exception(
+                f"One of {', '.join(sorted(sqlite_synchronous_levels))} expected, got {sqlite_synchronous} for sqlite_synchronous"
+            )
+        self.SQLITE_SYNCHRONOUS = sqlite_synchronous
+        self.SQLITE_MMAP_SIZE = int(
+            os.environ.get("SQLITE_MMAP_SIZE") or config.get(USER_CFG_SECTION, "sqlite_mmap_size")
+        )
+        self.SQLITE_BUSY_TIMEOUT = float(
+            os.environ.get("SQLITE_BUSY_TIMEOUT") or config.get(USER_CFG_SECTION, "sqlite_busy_timeout")
+        )
+        self.SQLITE_MAINTENANCE_MINUTES = float(
+            os.environ.get("SQLITE_MAINTENANCE_MINUTES") or config.get(USER_CFG_SECTION, "sqlite_maintenance_minutes")
+        )
 
         # Get config for scout
         self.SCOUT_MULTIPLIER = float(
@@ -87,6 +172,21 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             os.environ.get("SCOUT_SLEEP_TIME") or config.get(USER_CFG_SECTION, "scout_sleep_time")
         )
 
+        scout_modes = {
+            self.SCOUT_MODE_INTERVAL,
+            self.SCOUT_MODE_EVENT,
+        }
+        scout_mode = os.environ.get("SCOUT_MODE") or config.get(USER_CFG_SECTION, "scout_mode")
+        if scout_mode not in scout_modes:
+            raise Exception(f"{self.SCOUT_MODE_INTERVAL} or {self.SCOUT_MODE_EVENT} expected, got {scout_mode} for scout_mode")
+        self.SCOUT_MODE = scout_mode
+        self.SCOUT_DEBOUNCE = float(
+            os.environ.get("SCOUT_DEBOUNCE") or config.get(USER_CFG_SECTION, "scout_debounce")
+        )
+        self.SCOUT_MAX_RATE = float(
+            os.environ.get("SCOUT_MAX_RATE") or config.get(USER_CFG_SECTION, "scout_max_rate")
+        )
+
         self.RATIO_ADJUST_WEIGHT = int(
             os.environ.get("RATIO_ADJUST_WEIGHT") or config.get(USER_CFG_SECTION, "ratio_adjust_weight")
         )
@@ -95,6 +195,17 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             os.environ.get("RATIO_ADJUST_WEIGHT") or config.get(USER_CFG_SECTION, "ratio_adjust_weight")
         )
 
+        self.RATIO_ADJUST_FLUSH_MINUTES = float(
+            os.environ.get("RATIO_ADJUST_FLUSH_MINUTES") or config.get(USER_CFG_SECTION, "ratio_adjust_flush_minutes")
+        )
+        self.RATIO_ADJUST_INIT_THREADS = int(
+            os.environ.get("RATIO_ADJUST_INIT_THREADS") or config.get(USER_CFG_SECTION, "ratio_adjust_init_threads")
+        )
+        self.RATIO_ADJUST_INIT_WEIGHT_BUDGET = int(
+            os.environ.get("RATIO_ADJUST_INIT_WEIGHT_BUDGET")
+            or config.get(USER_CFG_SECTION, "ratio_adjust_init_weight_budget")
+        )
+
         self.MIN_BALANCE_BRIDGE_TRANSFER_MAIN2FUNDING = int(
             os.environ.get("MIN_BALANCE_BRIDGE_TRANSFER_MAIN2FUNDING") or config.get(USER_CFG_SECTION,
                                                                                      "min_balance_bridge_transfer_main2funding")
@@ -146,6 +257,10 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
 
         self.TRADE_FEE = os.environ.get("TRADE_FEE") or config.get(USER_CFG_SECTION, "trade_fee")
 
+        self.FEE_TABLE_BNB_PRICE_THRESHOLD = float(
+            os.environ.get("FEE_TABLE_BNB_PRICE_THRESHOLD") or config.get(USER_CFG_SECTION, "fee_table_bnb_price_threshold")
+        )
+
         self.STRATEGY = os.environ.get("STRATEGY") or config.get(USER_CFG_SECTION, "strategy")
 
         self.SCOUT_DEBUG = str(os.environ.get("SCOUT_DEBUG") or config.get(USER_CFG_SECTION, "scout_debug")).lower() == "true"
@@ -192,6 +307,10 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
 
         self.BUY_MAX_PRICE_CHANGE = os.environ.get("BUY_MAX_PRICE_CHANGE") or config.get(USER_CFG_SECTION, "buy_max_price_change")
 
+        self.BALANCE_UPDATE_TIMEOUT = float(
+            os.environ.get("BALANCE_UPDATE_TIMEOUT") or config.get(USER_CFG_SECTION, "balance_update_timeout")
+        )
+
         price_types = {
             self.PRICE_TYPE_ORDERBOOK,
             self.PRICE_TYPE_TICKER
@@ -204,6 +323,24 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             raise Exception(f"{self.PRICE_TYPE_ORDERBOOK} or {self.PRICE_TYPE_TICKER} expected, got {price_type} for price_type")
         self.PRICE_TYPE = price_type
 
+        market_data_parsers = {self.MARKET_DATA_PARSER_RAW, self.MARKET_DATA_PARSER_UNICORNFY}
+        market_data_parser = os.environ.get("MARKET_DATA_PARSER") or config.get(USER_CFG_SECTION, "market_data_parser")
+        if market_data_parser not in market_data_parsers:
+            raise Exception(
+                f"{self.MARKET_DATA_PARSER_RAW} or {self.MARKET_DATA_PARSER_UNICORNFY} expected, got {market_data_parser} "
+                "for market_data_parser"
+            )
+        self.MARKET_DATA_PARSER = market_data_parser
+
+        self.MARKET_DATA_MAX_SYMBOL_STREAMS = int(
+            os.environ.get("MARKET_DATA_MAX_SYMBOL_STREAMS")
+            or config.get(USER_CFG_SECTION, "market_data_max_symbol_streams")
+        )
+
+        self.UNSTREAMED_PRICE_TTL = float(
+            os.environ.get("UNSTREAMED_PRICE_TTL") or config.get(USER_CFG_SECTION, "unstreamed_price_ttl")
+        )
+
         accept_losses_str = os.environ.get("ACCEPT_LOSSES") or config.get(USER_CFG_SECTION, "accept_losses")
         self.ACCEPT_LOSSES = accept_losses_str == 'true' or accept_losses_str == 'True'
 
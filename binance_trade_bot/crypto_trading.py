@@ -5,6 +5,7 @@ from .config import Config
 from .database import Database
 from .logger import Logger
 from .scheduler import SafeScheduler
+from .scout_trigger import ScoutTrigger
 from .strategies import get_strategy
 from .auto_coin_selector import AutoCoinSelector
 
@@ -45,8 +46,14 @@ def main():
         db.set_coins(config.SUPPORTED_COIN_LIST)
 
 
+    scout_trigger = None
+    if config.SCOUT_MODE == Config.SCOUT_MODE_EVENT:
+        scout_trigger = ScoutTrigger(config.SCOUT_DEBOUNCE, config.SCOUT_MAX_RATE)
+        # the current coin and all its candidates
+        scout_trigger.watch(coin + config.BRIDGE for coin in db.get_coins())
+
     # needs to be executed AFTER updating to new coins!
-    manager.setup_websockets()
+    manager.setup_websockets(scout_trigger)
 
     
     # check if we can access API feature that require valid config
@@ -85,6 +92,7 @@ def main():
     trader.initialize()
 
     schedule = SafeScheduler(logger)
+    # with scout_mode=event price changes trigger the scouts, this timer only is a safety net then
     schedule.every(config.SCOUT_SLEEP_TIME).seconds.do(trader.scout).tag("scouting")
 
     #if config.SUPPORTED_COINS_METHOD == 'auto':
@@ -94,9 +102,20 @@ def main():
     schedule.every(1).minutes.do(trader.update_values).tag("updating value history")
     schedule.every(1).minutes.do(db.prune_scout_history).tag("pruning scout history")
     schedule.every(1).hours.do(db.prune_value_history).tag("pruning value history")
+    if config.SQLITE_MAINTENANCE_MINUTES > 0:
+        schedule.every(config.SQLITE_MAINTENANCE_MINUTES).minutes.do(db.vacuum_and_checkpoint).tag(
+            "database maintenance"
+        )
+
+    db.start_scout_history_writer()
     try:
         while True:
             schedule.run_pending()
-            time.sleep(1)
+            if scout_trigger is None:
+                time.sleep(1)
+            elif scout_trigger.wait(1):
+                schedule.run_tagged("scouting")
     finally:
         manager.stream_manager.close()
+        trader.close()
+        db.stop_scout_history_writer()
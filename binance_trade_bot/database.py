@@ -4,29 +4,106 @@ import time
 from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from socketio import Client
 from socketio.exceptions import ConnectionError as SocketIOConnectionError
-from sqlalchemy import create_engine, func, insert, select, update
-from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy import bindparam, create_engine, event, func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, joinedload, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from .config import Config
 from .logger import Logger
+from .model_cache import ModelCache
 from .models import *  # pylint: disable=wildcard-import
+from .schema import upgrade_schema
+from .scout_history_partitions import ScoutHistoryPartitions
+from .scout_history_writer import ScoutHistoryWriter
 
 LogScout = namedtuple("LogScout", ["pair", "target_ratio", "coin_price", "optional_coin_price"])
 
 
 class Database:
-    def __init__(self, logger: Logger, config: Config, uri="sqlite:///data/crypto_trading.db", isTest=False):
+    def __init__(
+        self,
+        logger: Logger,
+        config: Config,
+        uri="sqlite:///data/crypto_trading.db",
+        isTest=False,
+        cache_models=True,
+        read_only=False,
+    ):
         self.logger = logger
         self.config = config
-        self.engine = create_engine(uri)
-        self.session_factory = scoped_session(sessionmaker(bind=self.engine))
+        self.read_only = read_only
+        self.engine = self._create_engine(uri)
+        self.session_maker = sessionmaker(bind=self.engine)
+        self.session_factory = scoped_session(self.session_maker)
         self.socketio_client = Client()
         self.isTest=isTest
 
+        # Coins, pairs and the current coin are read on every scout, keep them in memory. Only safe as long as
+        # this process is the only writer, readers like the api server have to go to the database.
+        self.model_cache: Optional[ModelCache] = None
+        if cache_models:
+            self.model_cache = ModelCache()
+            event.listen(self.session_maker, "after_flush", self.model_cache.on_flush)
+            event.listen(self.session_maker, "after_commit", self.model_cache.on_commit)
+            event.listen(self.session_maker, "after_rollback", self.model_cache.on_rollback)
+            event.listen(self.session_maker, "before_attach", self.model_cache.on_attach)
+
+        self.scout_history_writer: Optional[ScoutHistoryWriter] = None
+        self.scout_history_partitions = ScoutHistoryPartitions(config.SCOUT_HISTORY_PARTITION_MINUTES)
+
+        # coin -> datetime of its newest value, decides which values become the hourly, daily and weekly ones
+        self._last_coin_value_datetimes: Optional[Dict[str, datetime]] = None
+
+    def _create_engine(self, uri: str) -> Engine:
+        url = make_url(uri)
+        if url.database in (None, "", ":memory:"):
+            # in-memory databases live in the connection of one thread, SQLAlchemy's defaults take care of that
+            return create_engine(url)
+
+        engine = create_engine(
+            url,
+            # the connections are reused by the session threads, the pool makes sure only one uses them at a time
+            poolclass=QueuePool,
+            connect_args={"timeout": self.config.SQLITE_BUSY_TIMEOUT, "check_same_thread": False},
+        )
+        if self.read_only:
+            event.listen(engine, "do_connect", self._connect_read_only)
+        event.listen(engine, "connect", self._configure_connection)
+        return engine
+
+    def _connect_read_only(self, _dialect, _connection_record, cargs, cparams):
+        """
+        Open the database read only, enforced by SQLite: the connection can't even take a write lock. That fails
+        while the bot hasn't created the database yet, until then the connections are normal ones that PRAGMA
+        query_only keeps from writing
+        """
+        database = cargs[0]
+        if os.path.exists(database):
+            cargs[0] = f"file:{database}?mode=ro"
+            cparams["uri"] = True
+        else:
+            self.logger.info(f"Database {database} doesn't exist yet, not opening it read only", notification=False)
+
+    def _configure_connection(self, dbapi_connection, _connection_record):
+        """
+        Apply the SQLite engine profile of the config to a new connection
+        """
+        cursor = dbapi_connection.cursor()
+        if self.read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            # stored in the database, the writer sets it up for the readers
+            cursor.execute(f"PRAGMA journal_mode = {self.config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {self.config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size = {self.config.SQLITE_MMAP_SIZE}")
+        cursor.close()
+
     def socketio_connect(self):
         if self.isTest:    return False
         if self.socketio_client.connected and self.socketio_client.namespaces:
@@ -92,6 +169,9 @@ class Database:
             return owned_coins
 
     def get_coins(self, only_enabled=True) -> List[Coin]:
+        if self.model_cache is not None:
+            coins = self.model_cache.coins(self.session_maker).values()
+            return [coin for coin in coins if coin.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             if only_enabled:
@@ -104,6 +184,8 @@ class Database:
     def get_coin(self, coin: Union[Coin, str]) -> Coin:
         if isinstance(coin, Coin):
             return coin
+        if self.model_cache is not None:
+            return self.model_cache.coins(self.session_maker).get(coin)
         session: Session
         with self.db_session() as session:
             coin = session.query(Coin).get(coin)
@@ -121,6 +203,9 @@ class Database:
             self.send_update(cc)
 
     def get_current_coin(self) -> Optional[Coin]:
+        if self.model_cache is not None:
+            symbol = self.model_cache.current_coin_symbol(self.session_maker)
+            return self.get_coin(symbol) if symbol is not None else None
         session: Session
         with self.db_session() as session:
             current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
@@ -133,6 +218,15 @@ class Database:
     def get_pair(self, from_coin: Union[Coin, str], to_coin: Union[Coin, str]):
         from_coin = self.get_coin(from_coin)
         to_coin = self.get_coin(to_coin)
+        if self.model_cache is not None:
+            return next(
+                (
+                    pair
+                    for pair in self.model_cache.pairs_from(self.session_maker, from_coin.symbol, False)
+                    if pair.to_coin_id == to_coin.symbol
+                ),
+                None,
+            )
         session: Session
         with self.db_session() as session:
             pair: Pair = session.query(Pair).filter(Pair.from_coin == from_coin, Pair.to_coin == to_coin).first()
@@ -141,6 +235,8 @@ class Database:
 
     def get_pairs_from(self, from_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
         from_coin = self.get_coin(from_coin)
+        if self.model_cache is not None:
+            return self.model_cache.pairs_from(self.session_maker, from_coin.symbol, only_enabled)
         session: Session
         with self.db_session() as session:
             pairs = session.query(Pair).filter(Pair.from_coin == from_coin)
@@ -151,6 +247,9 @@ class Database:
             return pairs
 
     def get_pairs(self, only_enabled=True) -> List[Pair]:
+        if self.model_cache is not None:
+            pairs_from = self.model_cache.all_pairs(self.session_maker)
+            return [pair for pairs in pairs_from.values() for pair in pairs if pair.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             pairs = session.query(Pair)
@@ -160,23 +259,101 @@ class Database:
             session.expunge_all()
             return pairs
 
+    def start_scout_history_writer(self):
+        """
+        Write the scout history from a background thread from now on
+        """
+        self.scout_history_writer = ScoutHistoryWriter(
+            self._insert_scout_history,
+            self.logger,
+            self.config.SCOUT_HISTORY_QUEUE_SIZE,
+            self.config.SCOUT_HISTORY_FLUSH_INTERVAL,
+        )
+        self.scout_history_writer.start()
+
+    def stop_scout_history_writer(self):
+        """
+        Write the pending scout history and go back to writing it synchronously
+        """
+        if self.scout_history_writer is not None:
+            self.scout_history_writer.close()
+            self.scout_history_writer = None
+
     def batch_log_scout(self, logs: List[LogScout]):
+        dt = datetime.now()
+        rows = [
+            {
+                "pair_id": ls.pair.id,
+                "target_ratio": ls.target_ratio,
+                "current_coin_price": ls.coin_price,
+                "other_coin_price": ls.optional_coin_price,
+                "datetime": dt,
+            }
+            for ls in logs
+        ]
+        if self.scout_history_writer is not None:
+            self.scout_history_writer.put(rows)
+        else:
+            self._insert_scout_history(rows)
+
+    def _insert_scout_history(self, rows: List[dict]):
+        if not rows:
+            return
         session: Session
         with self.db_session() as session:
-            dt = datetime.now()
-            session.execute(
-                insert(ScoutHistory),
-                [
-                    {
-                        "pair_id": ls.pair.id,
-                        "target_ratio": ls.target_ratio,
-                        "current_coin_price": ls.coin_price,
-                        "other_coin_price": ls.optional_coin_price,
-                        "datetime": dt,
-                    }
-                    for ls in logs
-                ],
-            )
+            self.scout_history_partitions.insert(session.connection(), rows)
+            if self.config.SCOUT_HISTORY_MODE == Config.SCOUT_HISTORY_MODE_COMPACT:
+                self._rollup_scout_history(session, rows)
+
+    @staticmethod
+    def _rollup_scout_history(session: Session, rows: List[dict]):
+        """
+        Fold the scouts into their per pair, per minute rollups. rows have to be in chronological order
+        """
+        rollups: Dict[Tuple[str, datetime], dict] = {}
+        for row in rows:
+            if not row["other_coin_price"]:
+                continue
+            ratio = row["current_coin_price"] / row["other_coin_price"]
+            minute = row["datetime"].replace(second=0, microsecond=0)
+            rollup = rollups.get((row["pair_id"], minute))
+            if rollup is None:
+                rollups[(row["pair_id"], minute)] = {
+                    "pair_id": row["pair_id"],
+                    "datetime": minute,
+                    "scouts": 1,
+                    "min_ratio": ratio,
+                    "max_ratio": ratio,
+                    "current_ratio": ratio,
+                    "target_ratio": row["target_ratio"],
+                    "current_coin_price": row["current_coin_price"],
+                    "other_coin_price": row["other_coin_price"],
+                }
+            else:
+                rollup["scouts"] += 1
+                rollup["min_ratio"] = min(rollup["min_ratio"], ratio)
+                rollup["max_ratio"] = max(rollup["max_ratio"], ratio)
+                rollup["current_ratio"] = ratio
+                rollup["target_ratio"] = row["target_ratio"]
+                rollup["current_coin_price"] = row["current_coin_price"]
+                rollup["other_coin_price"] = row["other_coin_price"]
+        if not rollups:
+            return
+
+        statement = sqlite_insert(ScoutHistoryRollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ScoutHistoryRollup.pair_id, ScoutHistoryRollup.datetime],
+            set_={
+                "scouts": ScoutHistoryRollup.scouts + statement.excluded.scouts,
+                "min_ratio": func.min(ScoutHistoryRollup.min_ratio, statement.excluded.min_ratio),
+                "max_ratio": func.max(ScoutHistoryRollup.max_ratio, statement.excluded.max_ratio),
+                "current_ratio": statement.excluded.current_ratio,
+                "target_ratio": statement.excluded.target_ratio,
+                "current_coin_price": statement.excluded.current_coin_price,
+                "other_coin_price": statement.excluded.other_coin_price,
+            },
+        )
+        session.execute(statement, list(rollups.values()))
 
     def log_scout(
         self,
@@ -185,85 +362,100 @@ class Database:
         current_coin_price: float,
         other_coin_price: float,
     ):
+        sh = ScoutHistory(pair, target_ratio, current_coin_price, other_coin_price)
+        self._insert_scout_history(
+            [
+                {
+                    "pair_id": pair.id,
+                    "target_ratio": target_ratio,
+                    "current_coin_price": current_coin_price,
+                    "other_coin_price": other_coin_price,
+                    "datetime": sh.datetime,
+                }
+            ]
+        )
+        self.send_update(sh)
+
+    def get_scout_history(self, coin: Union[Coin, str], since: Optional[datetime] = None) -> List[ScoutHistory]:
+        """
+        The scouts from the coin since the given datetime, oldest first, read from all the live partitions
+        """
+        coin_symbol = coin.symbol if isinstance(coin, Coin) else coin
         session: Session
         with self.db_session() as session:
-            pair = session.merge(pair)
-            sh = ScoutHistory(pair, target_ratio, current_coin_price, other_coin_price)
-            session.add(sh)
-            self.send_update(sh)
+            pairs = {
+                pair.id: pair
+                for pair in session.query(Pair)
+                .options(joinedload(Pair.from_coin), joinedload(Pair.to_coin))
+                .filter(Pair.from_coin_id == coin_symbol)
+            }
+            session.expunge_all()
+            rows = self.scout_history_partitions.select(session.connection(), pairs.keys(), since)
+        scouts = []
+        for row in rows:
+            scout = ScoutHistory(
+                pairs[int(row.pair_id)], row.target_ratio, row.current_coin_price, row.other_coin_price
+            )
+            scout.datetime = row.datetime
+            scouts.append(scout)
+        return scouts
 
     def prune_scout_history(self):
         time_diff = datetime.now() - timedelta(hours=self.config.SCOUT_HISTORY_PRUNE_TIME)
         session: Session
         with self.db_session() as session:
-            session.query(ScoutHistory).filter(ScoutHistory.datetime < time_diff).delete()
+            if self.config.SCOUT_HISTORY_MODE == Config.SCOUT_HISTORY_MODE_COMPACT:
+                # the rollups are kept for the whole period, the raw scouts only for a couple of minutes
+                session.query(ScoutHistoryRollup).filter(ScoutHistoryRollup.datetime < time_diff).delete()
+                time_diff = datetime.now() - timedelta(minutes=self.config.SCOUT_HISTORY_RAW_MINUTES)
+            # the raw scouts are partitioned by time, the ones older than time_diff go a whole partition at a time
+            self.scout_history_partitions.drop_before(session.connection(), time_diff)
 
     def prune_value_history(self):
-        def _datetime_id_query(dt_format):
-            dt_column = func.strftime(dt_format, CoinValue.datetime)
-
-            grouped = select(CoinValue, func.max(CoinValue.datetime), dt_column).group_by(
-                CoinValue.coin_id, CoinValue, dt_column
-            )
-
-            return select(grouped.c.id.label("id")).select_from(grouped)
-
-        def _update_query(datetime_query, interval):
-            return (
-                update(CoinValue)
-                .where(CoinValue.id.in_(datetime_query))
-                .values(interval=interval)
-                .execution_options(synchronize_session="fetch")
-            )
-
-        # Sets the first entry for each coin for each hour as 'hourly'
-        hourly_update_query = _update_query(_datetime_id_query("%H"), Interval.HOURLY)
-
-        # Sets the first entry for each coin for each month as 'weekly'
-        # (Sunday is the start of the week)
-        weekly_update_query = _update_query(
-            _datetime_id_query("%Y-%W"),
-            Interval.WEEKLY,
-        )
-
-        # Sets the first entry for each coin for each day as 'daily'
-        daily_update_query = _update_query(
-            _datetime_id_query("%Y-%j"),
-            Interval.DAILY,
-        )
-
+        # The values are rolled up when they are written, see _roll_up_coin_values, pruning is a range delete
+        # per interval
+        now = datetime.now()
         session: Session
         with self.db_session() as session:
-            session.execute(hourly_update_query)
-            session.execute(daily_update_query)
-            session.execute(weekly_update_query)
-
-            # Early commit to make sure the delete statements work properly.
-            session.commit()
-
             # The last 24 hours worth of minutely entries will be kept, so
             # count(coins) * 1440 entries
-            time_diff = datetime.now() - timedelta(hours=24)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.MINUTELY, CoinValue.datetime < time_diff
-            ).delete()
-
             # The last 28 days worth of hourly entries will be kept, so count(coins) * 672 entries
-            time_diff = datetime.now() - timedelta(days=28)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.HOURLY, CoinValue.datetime < time_diff
-            ).delete()
-
             # The last years worth of daily entries will be kept, so count(coins) * 365 entries
-            time_diff = datetime.now() - timedelta(days=365)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.DAILY, CoinValue.datetime < time_diff
-            ).delete()
+            for interval, kept in (
+                (Interval.MINUTELY, timedelta(hours=24)),
+                (Interval.HOURLY, timedelta(days=28)),
+                (Interval.DAILY, timedelta(days=365)),
+            ):
+                session.query(CoinValue).filter(
+                    CoinValue.interval == interval, CoinValue.datetime < now - kept
+                ).delete(synchronize_session=False)
 
             # All weekly entries will be kept forever
 
+    def vacuum_and_checkpoint(self):
+        """
+        Give the pages freed by the prunes back to the file system and fold the write-ahead log into the database,
+        so neither keeps growing
+        """
+        if self.is_memory_database():
+            return
+        connection = self.engine.raw_connection()
+        try:
+            # executed statement by statement the pragma only frees a single page, executescript runs it to completion
+            connection.executescript("PRAGMA incremental_vacuum;")
+            if self.config.SQLITE_JOURNAL_MODE == "wal":
+                cursor = connection.cursor()
+                busy, log_pages, checkpointed_pages = cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                cursor.close()
+                if busy:
+                    self.logger.debug(
+                        f"WAL checkpoint blocked by a reader, {checkpointed_pages} of {log_pages} pages checkpointed"
+                    )
+        finally:
+            connection.close()
+
     def create_database(self):
-        Base.metadata.create_all(self.engine)
+        upgrade_schema(self.engine, self.logger)
 
     def start_trade_log(self, from_coin: Coin, to_coin: Coin, selling: bool):
         return TradeLog(self, from_coin, to_coin, selling)
@@ -278,23 +470,92 @@ class Database:
             namespace="/backend",
         )
 
-    def batch_update_coin_values(self, cv_batch: List[CoinValue]):
+    def is_memory_database(self) -> bool:
+        """
+        An in-memory database only exists for the connection of one thread, it can't be written from the background
+        """
+        return self.engine.url.database in (None, "", ":memory:")
+
+    def bulk_update_pair_ratios(
+        self,
+        pair_ids: List[int],
+        ratios: List[float],
+        from_coin_prices: List[Optional[float]],
+        to_coin_prices: List[Optional[float]],
+    ):
+        """
+        Write pair ratios and the prices they were calculated from with one executemany. Bypasses the session's
+        change tracking, so the model cache is told explicitly once they are committed.
+        """
+        if not pair_ids:
+            return
         session: Session
         with self.db_session() as session:
             session.execute(
-                insert(CoinValue),
+                update(Pair.__table__)
+                .where(Pair.__table__.c.id == bindparam("pair_id"))
+                .values(
+                    ratio=bindparam("ratio"),
+                    from_coin_price=bindparam("from_price"),
+                    to_coin_price=bindparam("to_price"),
+                ),
                 [
-                    {
-                        "coin_id": cv.coin.symbol,
-                        "balance": cv.balance,
-                        "usd_price": cv.usd_price,
-                        "btc_price": cv.btc_price,
-                        "interval": cv.interval,
-                        "datetime": cv.datetime,
-                    }
-                    for cv in cv_batch
+                    {"pair_id": pair_id, "ratio": ratio, "from_price": from_coin_price, "to_price": to_coin_price}
+                    for pair_id, ratio, from_coin_price, to_coin_price in zip(
+                        pair_ids, ratios, from_coin_prices, to_coin_prices
+                    )
                 ],
             )
+        if self.model_cache is not None:
+            self.model_cache.invalidate_pairs()
+
+    def batch_update_coin_values(self, cv_batch: List[CoinValue]):
+        if not cv_batch:
+            return
+        rows = [
+            {
+                "coin_id": cv.coin.symbol,
+                "balance": cv.balance,
+                "usd_price": cv.usd_price,
+                "btc_price": cv.btc_price,
+                "interval": cv.interval,
+                "datetime": cv.datetime,
+            }
+            for cv in cv_batch
+        ]
+        session: Session
+        with self.db_session() as session:
+            self._roll_up_coin_values(session, rows)
+            session.execute(insert(CoinValue), rows)
+
+    def _roll_up_coin_values(self, session: Session, rows: List[dict]):
+        """
+        The first value of a coin in an hour, day or week becomes its hourly, daily or weekly value, the coarsest
+        one that applies. Decided on the way in, so pruning never has to search the history for them
+        """
+        if self._last_coin_value_datetimes is None:
+            self._last_coin_value_datetimes = dict(
+                session.query(CoinValue.coin_id, func.max(CoinValue.datetime)).group_by(CoinValue.coin_id).all()
+            )
+        for row in rows:
+            if row["interval"] != Interval.MINUTELY:
+                continue
+            previous = self._last_coin_value_datetimes.get(row["coin_id"])
+            row["interval"] = _coin_value_interval(previous, row["datetime"])
+            if previous is None or row["datetime"] > previous:
+                self._last_coin_value_datetimes[row["coin_id"]] = row["datetime"]
+
+
+def _coin_value_interval(previous: Optional[datetime], current: datetime) -> Interval:
+    # weeks start on Monday
+    for interval, dt_format in (
+        (Interval.WEEKLY, "%Y-%W"),
+        (Interval.DAILY, "%Y-%j"),
+        (Interval.HOURLY, "%Y-%j %H"),
+    ):
+        if previous is None or previous.strftime(dt_format) != current.strftime(dt_format):
+            return interval
+    return Interval.MINUTELY
 
 
 class TradeLog:
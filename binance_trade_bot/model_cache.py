@@ -0,0 +1,193 @@
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .models import Coin, CurrentCoin, Pair
+
+# key of the invalidations a session flushed but didn't commit yet in Session.info, and what they invalidate
+_PENDING_INVALIDATIONS = "model_cache_pending_invalidations"
+_COINS = "coins"
+_PAIRS = "pairs"
+_CURRENT_COIN = "current_coin"
+# marks the instances the cache hands out
+_READ_ONLY = "_model_cache_read_only"
+
+
+def _freeze(instances):
+    for instance in instances:
+        setattr(instance, _READ_ONLY, True)
+
+
+def check_writable(instance, *_args):
+    if getattr(instance, _READ_ONLY, False):
+        raise AttributeError(f"{instance!r} is shared by the model cache and read only, load it in a session instead")
+
+
+for _model in (Coin, Pair):
+    for _attribute in inspect(_model).attrs:
+        event.listen(getattr(_model, _attribute.key), "set", check_writable)
+
+
+class ModelCache:
+    """
+    In-process copy of the coins, the pair graph and the current coin.
+
+    Everything is loaded lazily and kept as detached objects. Database listens to the flushes of its
+    sessions and invalidates the affected parts once they are committed, so a read never returns
+    something older than the last write made through this process.
+
+    The same objects are handed to every thread, so they are read only: setting their attributes or adding
+    them to a session raises AttributeError. Session.merge() gives a session's own copy to change.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._coins: Optional[Dict[str, Coin]] = None
+        self._pairs_from: Dict[str, List[Pair]] = {}
+        self._enabled_pairs_from: Dict[str, List[Pair]] = {}
+        self._all_pairs_loaded = False
+        self._current_coin_symbol: Optional[str] = None
+        self._current_coin_loaded = False
+
+    def coins(self, session_factory) -> Dict[str, Coin]:
+        with self.lock:
+            if self._coins is None:
+                session: Session = session_factory()
+                try:
+                    coins = session.query(Coin).all()
+                    session.expunge_all()
+                finally:
+                    session.close()
+                _freeze(coins)
+                self._coins = {coin.symbol: coin for coin in coins}
+            return self._coins
+
+    def pairs_from(self, session_factory, from_coin_symbol: str, only_enabled=True) -> List[Pair]:
+        """
+        The same list object is returned until the pairs of from_coin_symbol are invalidated
+        """
+        with self.lock:
+            if only_enabled:
+                pairs = self._enabled_pairs_from.get(from_coin_symbol)
+                if pairs is None:
+                    pairs = [pair for pair in self.pairs_from(session_factory, from_coin_symbol, False) if pair.enabled]
+                    self._enabled_pairs_from[from_coin_symbol] = pairs
+                return pairs
+
+            pairs = self._pairs_from.get(from_coin_symbol)
+            if pairs is None and self._all_pairs_loaded:
+                return []
+            if pairs is None:
+                session: Session = session_factory()
+                try:
+                    pairs = session.query(Pair).filter(Pair.from_coin_id == from_coin_symbol).all()
+                    session.expunge_all()
+                finally:
+                    session.close()
+                self._freeze_pairs(pairs)
+                self._pairs_from[from_coin_symbol] = pairs
+            return pairs
+
+    def all_pairs(self, session_factory) -> Dict[str, List[Pair]]:
+        with self.lock:
+            if not self._all_pairs_loaded:
+                session: Session = session_factory()
+                try:
+                    pairs = session.query(Pair).all()
+                    session.expunge_all()
+                finally:
+                    session.close()
+                self._freeze_pairs(pairs)
+                pairs_from: Dict[str, List[Pair]] = {}
+                for pair in pairs:
+                    pairs_from.setdefault(pair.from_coin_id, []).append(pair)
+                self._pairs_from = pairs_from
+                self._enabled_pairs_from = {}
+                self._all_pairs_loaded = True
+            return self._pairs_from
+
+    def current_coin_symbol(self, session_factory) -> Optional[str]:
+        with self.lock:
+            if not self._current_coin_loaded:
+                session: Session = session_factory()
+                try:
+                    current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
+                    self._current_coin_symbol = current_coin.coin_id if current_coin is not None else None
+                finally:
+                    session.close()
+                self._current_coin_loaded = True
+            return self._current_coin_symbol
+
+    def invalidate_coins(self):
+        with self.lock:
+            self._coins = None
+            # pairs embed their coins, they have to go too
+            self.invalidate_pairs()
+
+    def invalidate_pairs(self, from_coin_symbol: Optional[str] = None):
+        with self.lock:
+            if from_coin_symbol is None:
+                self._pairs_from = {}
+                self._enabled_pairs_from = {}
+            else:
+                self._pairs_from.pop(from_coin_symbol, None)
+                self._enabled_pairs_from.pop(from_coin_symbol, None)
+            self._all_pairs_loaded = False
+
+    def invalidate_current_coin(self):
+        with self.lock:
+            self._current_coin_loaded = False
+
+    def on_flush(self, session: Session, _flush_context):
+        """
+        Note what the flushed session has written. Other sessions only see it after the commit, anything they
+        load before would be cached again, so the invalidation waits for on_commit
+        """
+        pending = session.info.setdefault(_PENDING_INVALIDATIONS, set())
+        for obj in session.new | session.deleted:
+            pending.add(self._invalidation_for(obj))
+        for obj in session.dirty:
+            if session.is_modified(obj):
+                pending.add(self._invalidation_for(obj))
+
+    def on_commit(self, session: Session):
+        """
+        Invalidate everything the committed session has written
+        """
+        for invalidation in session.info.pop(_PENDING_INVALIDATIONS, ()):
+            if invalidation == _COINS:
+                self.invalidate_coins()
+            elif invalidation == _CURRENT_COIN:
+                self.invalidate_current_coin()
+            elif invalidation is not None:
+                self.invalidate_pairs(invalidation[1])
+
+    def on_rollback(self, session: Session):
+        """
+        Also runs when a commit fails, when it's not certain what reached the database. Invalidating is always
+        safe, and the notes must not carry over to the next transaction of the session
+        """
+        self.on_commit(session)
+
+    @staticmethod
+    def _freeze_pairs(pairs: List[Pair]):
+        _freeze(pairs)
+        # their eagerly loaded coins are copies of their own
+        _freeze(pair.from_coin for pair in pairs)
+        _freeze(pair.to_coin for pair in pairs)
+
+    @staticmethod
+    def on_attach(_session: Session, instance):
+        check_writable(instance)
+
+    @staticmethod
+    def _invalidation_for(obj):
+        if isinstance(obj, Coin):
+            return _COINS
+        if isinstance(obj, Pair):
+            return _PAIRS, obj.from_coin_id if obj.from_coin_id is not None else obj.from_coin.symbol
+        if isinstance(obj, CurrentCoin):
+            return _CURRENT_COIN
+        return None
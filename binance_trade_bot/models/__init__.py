@@ -4,4 +4,5 @@ from .coin_value import CoinValue, Interval
 from .current_coin import CurrentCoin
 from .pair import Pair
 from .scout_history import ScoutHistory
+from .scout_history_rollup import ScoutHistoryRollup
 from .trade import Trade, TradeState
@@ -12,7 +12,7 @@ class CurrentCoin(Base):  # pylint: disable=too-few-public-methods
     id = Column(Integer, primary_key=True)
     coin_id = Column(String, ForeignKey("coins.symbol"))
     coin = relationship("Coin")
-    datetime = Column(DateTime)
+    datetime = Column(DateTime, index=True)
 
     def __init__(self, coin: Coin):
         self.coin = coin
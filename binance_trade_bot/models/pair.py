@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Float, ForeignKey, Integer, String, func, or_, select
-from sqlalchemy.orm import column_property, relationship
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String, func, or_, select
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship
 
 from .base import Base
 from .coin import Coin
@@ -7,13 +8,14 @@ from .coin import Coin
 
 class Pair(Base):
     __tablename__ = "pairs"
+    __table_args__ = (Index("ix_pairs_from_coin_id_to_coin_id", "from_coin_id", "to_coin_id", unique=True),)
 
     id = Column(Integer, primary_key=True)
 
     from_coin_id = Column(String, ForeignKey("coins.symbol"))
     from_coin = relationship("Coin", foreign_keys=[from_coin_id], lazy="joined")
 
-    to_coin_id = Column(String, ForeignKey("coins.symbol"))
+    to_coin_id = Column(String, ForeignKey("coins.symbol"), index=True)
     to_coin = relationship("Coin", foreign_keys=[to_coin_id], lazy="joined")
 
     ratio = Column(Float)
@@ -22,13 +24,6 @@ class Pair(Base):
 
     to_coin_price = Column(Float)
 
-    enabled = column_property(
-        select([func.count(Coin.symbol) == 2])
-        .where(or_(Coin.symbol == from_coin_id, Coin.symbol == to_coin_id))
-        .where(Coin.enabled.is_(True))
-        .scalar_subquery()
-    )
-
     def __init__(self, from_coin: Coin, to_coin: Coin, ratio=None, from_coin_price=None, to_coin_price=None):
         self.from_coin = from_coin
         self.to_coin = to_coin
@@ -36,6 +31,20 @@ class Pair(Base):
         self.from_coin_price = from_coin_price
         self.to_coin_price = to_coin_price
 
+    @hybrid_property
+    def enabled(self):
+        # both coins are eagerly loaded, no need to ask the database
+        return bool(self.from_coin.enabled and self.to_coin.enabled)
+
+    @enabled.expression
+    def enabled(cls):  # pylint: disable=no-self-argument
+        return (
+            select([func.count(Coin.symbol) == 2])
+            .where(or_(Coin.symbol == cls.from_coin_id, Coin.symbol == cls.to_coin_id))
+            .where(Coin.enabled.is_(True))
+            .scalar_subquery()
+        )
+
     def __repr__(self):
         return f"<{self.from_coin_id}->{self.to_coin_id} :: {self.ratio} = {self.from_coin_price} / {self.to_coin_price}>"
 
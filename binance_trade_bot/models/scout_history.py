@@ -9,6 +9,11 @@ from .pair import Pair
 
 
 class ScoutHistory(Base):
+    """
+    The scouts are stored in time partitions, see ScoutHistoryPartitions, the scout_history table only exists in
+    databases before schema version 4. Database.get_scout_history returns them as transient instances
+    """
+
     __tablename__ = "scout_history"
 
     id = Column(Integer, primary_key=True)
@@ -20,7 +25,7 @@ class ScoutHistory(Base):
     current_coin_price = Column(Float)
     other_coin_price = Column(Float)
 
-    datetime = Column(DateTime)
+    datetime = Column(DateTime, index=True)
 
     def __init__(
         self,
@@ -0,0 +1,44 @@
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.orm import relationship
+
+from .base import Base
+
+
+class ScoutHistoryRollup(Base):
+    """
+    The scouts of one pair within one minute: minimum, maximum and last ratio, and the prices of the last scout
+    """
+
+    __tablename__ = "scout_history_rollups"
+    __table_args__ = (UniqueConstraint("pair_id", "datetime"),)
+
+    id = Column(Integer, primary_key=True)
+
+    pair_id = Column(String, ForeignKey("pairs.id"))
+    pair = relationship("Pair")
+
+    # start of the minute
+    datetime = Column(DateTime, index=True)
+
+    scouts = Column(Integer)
+    min_ratio = Column(Float)
+    max_ratio = Column(Float)
+    current_ratio = Column(Float)
+
+    target_ratio = Column(Float)
+    current_coin_price = Column(Float)
+    other_coin_price = Column(Float)
+
+    def info(self):
+        return {
+            "from_coin": self.pair.from_coin.info(),
+            "to_coin": self.pair.to_coin.info(),
+            "current_ratio": self.current_ratio,
+            "min_ratio": self.min_ratio,
+            "max_ratio": self.max_ratio,
+            "scouts": self.scouts,
+            "target_ratio": self.target_ratio,
+            "current_coin_price": self.current_coin_price,
+            "other_coin_price": self.other_coin_price,
+            "datetime": self.datetime.isoformat(),
+        }
@@ -0,0 +1,112 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+PRICE_LAST = "last"
+PRICE_BID = "bid"
+PRICE_ASK = "ask"
+
+
+class PriceBoard:
+    """
+    The last, bid and ask prices of every symbol and the exchange time of their last update, in arrays indexed by
+    a slot every symbol gets once. Unknown prices are nan, unknown event times 0.
+
+    Writers change the board inside write(), one batch of updates at a time, and may add the symbols of the batch
+    with slot() inside it. sequence is odd while a batch is written and grows by two with every batch, so readers
+    can take a consistent snapshot without a lock: read the sequence, the values, and the sequence again, and retry
+    if it was odd or changed in between. That's what read() does.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self._slots: Dict[str, int] = {}
+        self.symbols: List[str] = []
+        self.last = np.full(capacity, np.nan)
+        self.bid = np.full(capacity, np.nan)
+        self.ask = np.full(capacity, np.nan)
+        self.event_time = np.zeros(capacity, dtype=np.int64)
+        self.sequence = 0
+        self._write_lock = threading.RLock()
+        # write() can be nested, only the outermost one changes the sequence
+        self._write_depth = 0
+
+    @contextmanager
+    def write(self):
+        with self._write_lock:
+            self._write_depth += 1
+            if self._write_depth == 1:
+                self.sequence += 1
+            try:
+                yield self
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self.sequence += 1
+
+    def slot(self, symbol: str) -> int:
+        slot = self._slots.get(symbol)
+        if slot is None:
+            with self.write():
+                slot = self._slots.get(symbol)
+                if slot is None:
+                    slot = len(self.symbols)
+                    if slot == len(self.last):
+                        self._grow(2 * slot)
+                    self.symbols.append(symbol)
+                    self._slots[symbol] = slot
+        return slot
+
+    def slots(self, symbols: Iterable[str]) -> np.ndarray:
+        return np.array([self.slot(symbol) for symbol in symbols], dtype=np.intp)
+
+    def _grow(self, capacity: int):
+        # the grown arrays replace the old ones as a whole, readers that still hold the old ones retry on the
+        # sequence change
+        grow = capacity - len(self.last)
+        self.last = np.concatenate([self.last, np.full(grow, np.nan)])
+        self.bid = np.concatenate([self.bid, np.full(grow, np.nan)])
+        self.ask = np.concatenate([self.ask, np.full(grow, np.nan)])
+        self.event_time = np.concatenate([self.event_time, np.zeros(grow, dtype=np.int64)])
+
+    def set_last(self, slot: int, price: float, event_time: int = 0):
+        """
+        Only inside write()
+        """
+        self.last[slot] = price
+        if event_time:
+            self.event_time[slot] = event_time
+
+    def set_book(self, slot: int, bid_price: float, ask_price: float, event_time: int = 0):
+        """
+        Only inside write()
+        """
+        self.bid[slot] = bid_price
+        self.ask[slot] = ask_price
+        if event_time:
+            self.event_time[slot] = event_time
+
+    def read(self, column: str, slots: np.ndarray) -> np.ndarray:
+        """
+        A consistent copy of the prices of the slots, column is one of PRICE_LAST, PRICE_BID and PRICE_ASK
+        """
+        while True:
+            sequence = self.sequence
+            if sequence % 2 == 0:
+                prices = getattr(self, column)[slots]
+                if self.sequence == sequence:
+                    return prices
+            # let the writer finish its batch
+            time.sleep(0)
+
+    def get(self, column: str, symbol: str) -> Optional[float]:
+        """
+        The price of the symbol, None if it's unknown
+        """
+        slot = self._slots.get(symbol)
+        if slot is None:
+            return None
+        price = getattr(self, column)[slot]
+        return None if price != price else float(price)
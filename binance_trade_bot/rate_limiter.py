@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+
+# GET /api/v3/klines, whatever the limit, see
+# https://developers.binance.com/docs/binance-spot-api-docs/rest-api/market-data-endpoints#klinecandlestick-data
+KLINES_REQUEST_WEIGHT = 2
+
+
+def historical_klines_request_weight(klines: int, limit: int) -> int:
+    """
+    Request weight of Client.get_historical_klines fetching klines klines, limit per request. It requests the
+    earliest kline of the symbol first, then the klines until one comes back with less than limit of them, which
+    is an empty one if the last full one ended the range
+    """
+    return (1 + klines // limit + 1) * KLINES_REQUEST_WEIGHT
+
+
+class RequestWeightLimiter:
+    """
+    Keeps the request weight spent within the last minute under budget, shared by any number of threads
+    """
+
+    def __init__(self, budget: int, period: float = 60):
+        self.budget = budget
+        self.period = period
+        self._lock = threading.Lock()
+        self._spent: Deque[Tuple[float, int]] = deque()
+        self._spent_weight = 0
+
+    def acquire(self, weight: int):
+        """
+        Block until weight can be spent without exceeding the budget
+        """
+        # a single request heavier than the whole budget still has to go through at some point
+        weight = min(weight, self.budget)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._spent and self._spent[0][0] <= now - self.period:
+                    self._spent_weight -= self._spent.popleft()[1]
+                if self._spent_weight + weight <= self.budget:
+                    self._spent.append((now, weight))
+                    self._spent_weight += weight
+                    return
+                wait = self._spent[0][0] + self.period - now
+            time.sleep(wait)
@@ -0,0 +1,580 @@
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .binance_api_manager import BinanceAPIManager
+from .config import Config
+from .models import Coin, Pair
+
+
+class ScoutScores:  # pylint: disable=too-few-public-methods
+    """
+    Result of scoring all jump candidates of one coin
+    """
+
+    def __init__(self, pairs: List[Pair], prices: np.ndarray, scores: np.ndarray, missing: List[Pair]):
+        # pairs, prices and scores are aligned: scores[k] is the ratio of pairs[k] at candidate price prices[k]
+        self.pairs = pairs
+        self.prices = prices
+        self.scores = scores
+        # pairs whose candidate price is unknown, they aren't scored
+        self.missing = missing
+
+
+class CandidateIndex:
+    """
+    Trigger prices of the jump candidates of one coin, kept in a heap.
+
+    The trigger price of a pair is the price of its from coin above which the pair scores positive, given the
+    candidate price, the pair ratio and the fees. The lower the trigger price, the better the candidate, so the
+    top of the heap answers both whether any pair crossed and which one is best. Entries whose trigger price has
+    changed since they were pushed are dropped lazily when they reach the top.
+    """
+
+    def __init__(
+        self,
+        pairs: List[Pair],
+        to_slots: np.ndarray,
+        pair_array: np.ndarray,
+        triggers: np.ndarray,
+        seen: int,
+    ):
+        # the pair list the index was built from, a new list means new ratios
+        self.pairs = pairs
+        self.to_slots = to_slots
+        self.pair_array = pair_array
+        self.triggers = triggers
+        self.positions = {slot: k for k, slot in enumerate(to_slots.tolist())}
+        # how far the engine's price change log has been applied
+        self.seen = seen
+        # price board sequence the candidate prices were last read at, None if not all of them came from the board
+        self.board_sequence: Optional[int] = None
+        self._heap: List[Tuple[float, int]] = []
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(trigger, k) for k, trigger in enumerate(self.triggers.tolist()) if trigger == trigger]
+        heapq.heapify(self._heap)
+
+    def update(self, position: int, trigger: float):
+        self.triggers[position] = trigger
+        if trigger == trigger:  # nan never is a candidate
+            heapq.heappush(self._heap, (trigger, position))
+        if len(self._heap) > 2 * len(self.triggers) + 16:
+            self._rebuild_heap()
+
+    def _pop_stale(self):
+        heap = self._heap
+        while heap and heap[0][0] != self.triggers[heap[0][1]]:
+            heapq.heappop(heap)
+
+    def best(self, excluded_slots=()) -> Optional[int]:
+        """
+        Position of the candidate with the lowest trigger price that isn't excluded
+        """
+        self._pop_stale()
+        if not excluded_slots:
+            return self._heap[0][1] if self._heap else None
+
+        skipped = []
+        best = None
+        while self._heap:
+            trigger, position = self._heap[0]
+            if trigger != self.triggers[position]:
+                heapq.heappop(self._heap)
+            elif self.to_slots[position] in excluded_slots:
+                skipped.append(heapq.heappop(self._heap))
+            else:
+                best = position
+                break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return best
+
+
+class RatioScoringEngine:
+    """
+    Holds pair ratios, candidate prices and fees as arrays indexed by coin and scores all the
+    candidates of a coin in one vectorized pass.
+    """
+
+    def __init__(self, manager: BinanceAPIManager, config: Config):
+        self.manager = manager
+        self.config = config
+        self.coin_index: Dict[str, int] = {}
+        self.symbols: List[str] = []
+        self.ratios = np.full((0, 0), np.nan)
+        self.prices = np.full(0, np.nan)
+        # slot of every coin's bridge symbol on the manager's price board
+        self._board_slots = np.full(0, -1, dtype=np.intp)
+        # fees as reported by the manager, nan when not known yet. Dropped whenever the manager's fees version changes
+        self.buy_fees = np.full(0, np.nan)
+        self.sell_fees = np.full(0, np.nan)
+        self._fees_version = None
+        # from slot -> (pairs as loaded, slots of their to coins, pairs as array)
+        self._rows: Dict[int, Tuple[List[Pair], np.ndarray, np.ndarray]] = {}
+        # from slot -> trigger prices of its pairs. Dropped whenever the fees change
+        self._indexes: Dict[int, CandidateIndex] = {}
+        # slots whose price changed, in order. _price_changes_start is the absolute position of its first entry
+        self._price_changes: List[int] = []
+        self._price_changes_start = 0
+        # ratios can be adjusted in memory and flushed later. _db_ratios is what the database is known to hold,
+        # _dirty marks the adjusted ratios that aren't flushed yet. _flushing holds the cells and the ratios of the
+        # flush in progress, see take_dirty_ratios and finish_flush, which runs on the flushing thread
+        self._db_ratios = np.full((0, 0), np.nan)
+        self._dirty = np.zeros((0, 0), dtype=bool)
+        self._flushing: Optional[Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]] = None
+        self._flush_lock = threading.RLock()
+        self._from_coin_prices = np.full((0, 0), np.nan)
+        self._to_coin_prices = np.full((0, 0), np.nan)
+        self._pair_ids = np.full((0, 0), -1, dtype=np.int64)
+
+    @staticmethod
+    def _grow_matrix(matrix: np.ndarray, capacity: int, fill) -> np.ndarray:
+        grown = np.full((capacity, capacity), fill, dtype=matrix.dtype)
+        grown[: len(matrix), : len(matrix)] = matrix
+        return grown
+
+    def _grow(self, size: int):
+        with self._flush_lock:
+            self._grow_unlocked(size)
+
+    def _grow_unlocked(self, size: int):
+        capacity = len(self.prices)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 16)
+        self.ratios = self._grow_matrix(self.ratios, new_capacity, np.nan)
+        self._db_ratios = self._grow_matrix(self._db_ratios, new_capacity, np.nan)
+        self._dirty = self._grow_matrix(self._dirty, new_capacity, False)
+        self._from_coin_prices = self._grow_matrix(self._from_coin_prices, new_capacity, np.nan)
+        self._to_coin_prices = self._grow_matrix(self._to_coin_prices, new_capacity, np.nan)
+        self._pair_ids = self._grow_matrix(self._pair_ids, new_capacity, -1)
+        self.prices = np.concatenate([self.prices, np.full(new_capacity - capacity, np.nan)])
+        self._board_slots = np.concatenate([self._board_slots, np.full(new_capacity - capacity, -1, dtype=np.intp)])
+        self.buy_fees = np.concatenate([self.buy_fees, np.full(new_capacity - capacity, np.nan)])
+        self.sell_fees = np.concatenate([self.sell_fees, np.full(new_capacity - capacity, np.nan)])
+
+    def coin_slot(self, symbol: str) -> int:
+        slot = self.coin_index.get(symbol)
+        if slot is None:
+            slot = len(self.symbols)
+            self.coin_index[symbol] = slot
+            self.symbols.append(symbol)
+            self._grow(slot + 1)
+            self._board_slots[slot] = self.manager.get_price_board_slot(symbol + self.config.BRIDGE.symbol)
+        return slot
+
+    def load_pairs(self, from_coin: Coin, pairs: List[Pair]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Store the ratios of the given pairs of from_coin, returns the slots of their to coins and the pairs as array.
+        Loading the very same list again is free, the database model cache hands out the same list until it changes.
+        """
+        from_slot = self.coin_slot(from_coin.symbol)
+        row = self._rows.get(from_slot)
+        if row is not None and row[0] is pairs:
+            return row[1], row[2]
+
+        to_slots = np.fromiter((self.coin_slot(pair.to_coin_id) for pair in pairs), dtype=np.intp, count=len(pairs))
+        pair_array = np.empty(len(pairs), dtype=object)
+        pair_array[:] = pairs
+        db_ratios = np.fromiter(
+            (np.nan if pair.ratio is None else pair.ratio for pair in pairs), dtype=float, count=len(pairs)
+        )
+        with self._flush_lock:
+            # ratios that are still what we know the database holds, or what the flush in progress writes, were
+            # adjusted in memory since, keep those. Anything else was written by someone else and wins over the
+            # adjustments
+            unchanged = db_ratios == self._db_ratios[from_slot, to_slots]
+            if self._flushing is not None:
+                unchanged |= db_ratios == self._flushing_row(from_slot)[to_slots]
+            ratios = np.where(unchanged, self.ratios[from_slot, to_slots], db_ratios)
+            dirty = self._dirty[from_slot, to_slots] & unchanged
+
+            self.ratios[from_slot, :] = np.nan
+            self.ratios[from_slot, to_slots] = ratios
+            self._db_ratios[from_slot, :] = np.nan
+            self._db_ratios[from_slot, to_slots] = db_ratios
+            self._dirty[from_slot, :] = False
+            self._dirty[from_slot, to_slots] = dirty
+        self._pair_ids[from_slot, :] = -1
+        self._pair_ids[from_slot, to_slots] = np.fromiter((pair.id for pair in pairs), dtype=np.int64, count=len(pairs))
+        self._rows[from_slot] = (pairs, to_slots, pair_array)
+        return to_slots, pair_array
+
+    def adjust_ratios(self, coins: List[Coin], pairs: List[List[Pair]], weight: float):
+        """
+        Move the ratios of all the given pairs towards their current price ratio, weighted like
+        (ratio * weight + from_coin_price / to_coin_price) / (weight + 1), in memory. pairs[k] are the pairs of coins[k],
+        pairs without a ratio or a price are left alone. take_dirty_ratios hands out what has to be flushed.
+        """
+        from_slots = np.fromiter((self.coin_slot(coin.symbol) for coin in coins), dtype=np.intp, count=len(coins))
+        rows = [self.load_pairs(coin, coin_pairs)[0] for coin, coin_pairs in zip(coins, pairs)]
+        to_slots = np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.intp)
+        if not len(to_slots):
+            return
+
+        from_coin_prices, _ = self._board_prices(from_slots, self.manager.get_sell_prices, self.manager.get_sell_price)
+        self.refresh_prices(to_slots)
+        to_coin_prices = self.prices[to_slots]
+
+        cells = np.ix_(from_slots, to_slots)
+        ratios = self.ratios[cells]
+        adjusted = (ratios * weight + from_coin_prices[:, np.newaxis] / to_coin_prices[np.newaxis, :]) / (weight + 1)
+        adjustable = ~np.isnan(adjusted)
+
+        self.ratios[cells] = np.where(adjustable, adjusted, ratios)
+        self._from_coin_prices[cells] = np.where(
+            adjustable, from_coin_prices[:, np.newaxis], self._from_coin_prices[cells]
+        )
+        self._to_coin_prices[cells] = np.where(adjustable, to_coin_prices[np.newaxis, :], self._to_coin_prices[cells])
+        with self._flush_lock:
+            self._dirty[cells] |= adjustable
+        # the trigger prices depend on the ratios
+        self._indexes = {}
+
+    def take_dirty_ratios(self) -> Tuple[List[int], List[float], List[float], List[float]]:
+        """
+        Pair ids, ratios, from coin and to coin prices of the ratios adjusted and not flushed yet. They stay dirty
+        until finish_flush reports they were written, only one flush can be in progress at a time.
+        """
+        with self._flush_lock:
+            cells = np.nonzero(self._dirty)
+            ratios = self.ratios[cells]
+            self._flushing = (cells, ratios)
+            pair_ids = self._pair_ids[cells]
+            from_coin_prices = self._from_coin_prices[cells]
+            to_coin_prices = self._to_coin_prices[cells]
+        return pair_ids.tolist(), ratios.tolist(), from_coin_prices.tolist(), to_coin_prices.tolist()
+
+    def finish_flush(self, flushed: bool):
+        """
+        End the flush take_dirty_ratios started. Once the ratios are committed, they are what the database holds and
+        only the ones adjusted again meanwhile stay dirty. A failed flush leaves them all dirty for the next one
+        """
+        with self._flush_lock:
+            if flushed and self._flushing is not None:
+                cells, ratios = self._flushing
+                self._db_ratios[cells] = ratios
+                self._dirty[cells] &= self.ratios[cells] != ratios
+            self._flushing = None
+
+    def _flushing_row(self, from_slot: int) -> np.ndarray:
+        """
+        The ratios the flush in progress writes for the pairs of from_slot by to slot, nan where it writes none
+        """
+        (from_slots, to_slots), ratios = self._flushing
+        row = np.full(len(self._db_ratios), np.nan)
+        of_row = from_slots == from_slot
+        row[to_slots[of_row]] = ratios[of_row]
+        return row
+
+    def _board_prices(self, slots: np.ndarray, get_prices, get_price) -> Tuple[np.ndarray, bool]:
+        """
+        Prices of the coins against the bridge, read from the price board in one go, and whether the board knew all
+        of them. Only the ones it doesn't know yet are asked for one by one, which may fetch them. Still unknown
+        prices are nan
+        """
+        prices = get_prices(self._board_slots[slots])
+        off_board = np.flatnonzero(np.isnan(prices)).tolist()
+        bridge = self.config.BRIDGE.symbol
+        for position in off_board:
+            price = get_price(self.symbols[slots[position]] + bridge)
+            if price is not None:
+                prices[position] = price
+        return prices, not off_board
+
+    def refresh_prices(self, slots: np.ndarray) -> bool:
+        """
+        Read the candidate prices of the slots and log the ones that changed. Returns whether the price board knew
+        all of them, only then they can't change without the board changing
+        """
+        prices, on_board = self._board_prices(slots, self.manager.get_buy_prices, self.manager.get_buy_price)
+        old_prices = self.prices[slots]
+        changed = (prices != old_prices) & ~(np.isnan(prices) & np.isnan(old_prices))
+        if changed.any():
+            changed_slots = slots[changed]
+            self.prices[changed_slots] = prices[changed]
+            self._price_changes.extend(changed_slots.tolist())
+        return on_board
+
+    def _validate_fees(self):
+        fees_version = self.manager.get_fees_version()
+        if fees_version != self._fees_version:
+            self._fees_version = fees_version
+            self.buy_fees[:] = np.nan
+            self.sell_fees[:] = np.nan
+            self._indexes = {}
+
+    def refresh_buy_fees(self, slots: np.ndarray):
+        for slot in slots[np.isnan(self.buy_fees[slots])].tolist():
+            self.buy_fees[slot] = self.manager.get_fee(Coin(self.symbols[slot]), self.config.BRIDGE, False)
+
+    def sell_fee(self, coin: Coin) -> float:
+        slot = self.coin_slot(coin.symbol)
+        if np.isnan(self.sell_fees[slot]):
+            self.sell_fees[slot] = self.manager.get_fee(coin, self.config.BRIDGE, True)
+        return self.sell_fees[slot]
+
+    def score(self, coin: Coin, coin_price: float, pairs: List[Pair], excluded_symbols: List[str] = ()) -> ScoutScores:
+        """
+        Score every pair of coin with the margin or the multiplier formula, depending on USE_MARGIN
+        """
+        from_slot = self.coin_slot(coin.symbol)
+        to_slots, pair_array = self.load_pairs(coin, pairs)
+        if excluded_symbols:
+            included = ~np.isin(to_slots, [self.coin_slot(symbol) for symbol in excluded_symbols])
+            to_slots = to_slots[included]
+            pair_array = pair_array[included]
+
+        self.refresh_prices(to_slots)
+        prices = self.prices[to_slots]
+        priced = ~np.isnan(prices)
+        missing = pair_array[~priced].tolist()
+
+        to_slots = to_slots[priced]
+        prices = prices[priced]
+        ratios = self.ratios[from_slot, to_slots]
+        pair_array = pair_array[priced]
+
+        transaction_fees = self._transaction_fees(coin, to_slots)
+        scores = self._scores(coin_price, prices, ratios, transaction_fees)
+
+        # pairs without a ratio can't be scored
+        scored = ~np.isnan(ratios)
+        if not scored.all():
+            pair_array = pair_array[scored]
+            prices = prices[scored]
+            scores = scores[scored]
+
+        return ScoutScores(pair_array.tolist(), prices, scores, missing)
+
+    def bridge_scout_targets(
+        self,
+        coins: List[Coin],
+        coin_prices: List[float],
+        pairs: List[List[Pair]],
+        excluded_symbols: List[str] = (),
+    ) -> np.ndarray:
+        """
+        For every coin, whether none of its pairs scores positive at its coin price. All coins are scored
+        in one pass over the ratio matrix, pairs[k] are the pairs of coins[k].
+        """
+        from_slots = np.fromiter((self.coin_slot(coin.symbol) for coin in coins), dtype=np.intp, count=len(coins))
+        rows = [self.load_pairs(coin, coin_pairs)[0] for coin, coin_pairs in zip(coins, pairs)]
+        to_slots = np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.intp)
+        if excluded_symbols:
+            to_slots = to_slots[~np.isin(to_slots, list(self._excluded_slots(excluded_symbols)))]
+        if not len(to_slots):
+            return np.ones(len(coins), dtype=bool)
+
+        self.refresh_prices(to_slots)
+        self._validate_fees()
+        self.refresh_buy_fees(to_slots)
+        from_fees = np.array([self.sell_fee(coin) for coin in coins])[:, np.newaxis]
+        to_fees = self.buy_fees[to_slots][np.newaxis, :]
+        transaction_fees = from_fees + to_fees - from_fees * to_fees
+
+        # pairs without price or ratio score nan, which isn't positive either
+        scores = self._scores(
+            np.asarray(coin_prices, dtype=float)[:, np.newaxis],
+            self.prices[to_slots][np.newaxis, :],
+            self.ratios[np.ix_(from_slots, to_slots)],
+            transaction_fees,
+        )
+        with np.errstate(invalid="ignore"):
+            return ~np.any(scores > 0, axis=1)
+
+    def _transaction_fees(self, coin: Coin, to_slots: np.ndarray) -> np.ndarray:
+        self._validate_fees()
+        self.refresh_buy_fees(to_slots)
+        from_fee = self.sell_fee(coin) if len(to_slots) else 0.0
+        to_fees = self.buy_fees[to_slots]
+        return from_fee + to_fees - from_fee * to_fees
+
+    def _scores(
+        self, coin_price: float, prices: np.ndarray, ratios: np.ndarray, transaction_fees: np.ndarray
+    ) -> np.ndarray:
+        # Obtain (current coin)/(optional coin)
+        current2possible_ratios = coin_price / prices
+
+        ######  Original formula:  #####
+        #
+        #   ((current2possible_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * current2possible_ratio) - pair.ratio)
+        #
+        #
+
+        ######  Normalized formula: #####
+        #
+        #   ((current2possible_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * current2possible_ratio) - pair.ratio) * 100 / pair.ratio
+        #   ((current2possible_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * current2possible_ratio) / pair.ratio - 1) * 100
+        #   ((1                      - transaction_fee * self.config.SCOUT_MULTIPLIER) * current2possible_ratio / pair.ratio - 1) * 100
+        #
+        #  short:
+        #
+        #   ((1 - transaction_fee * self.config.SCOUT_MULTIPLIER) * current2possible_ratio / pair.ratio - 1) * 100
+        #
+        #  from: https://github.com/edeng23/binance-trade-bot/issues/385
+        #
+
+        ######  Margin formula: #####
+        #
+        #   ((1 - transaction_fee) * current2possible_ratio / pair.ratio - 1) * 100 - self.config.SCOUT_MARGIN
+        #
+        #  from: https://github.com/edeng23/binance-trade-bot/pull/417/files#diff-d2579cf2f5170dacac5d1dbfa2ac255210dbd8fba50b28aa04cbee38aed1e9fbR138
+        #
+
+        if self.config.USE_MARGIN:
+            return ((1 - transaction_fees) * current2possible_ratios / ratios - 1) * 100 - self.config.SCOUT_MARGIN
+        return ((1 - transaction_fees * self.config.SCOUT_MULTIPLIER) * current2possible_ratios / ratios - 1) * 100
+
+    def _trigger_prices(self, prices: np.ndarray, ratios: np.ndarray, transaction_fees: np.ndarray) -> np.ndarray:
+        """
+        Solve the formulas of _scores for the coin price at which the score is zero:
+
+            margin:      coin_price > price * ratio * (1 + SCOUT_MARGIN / 100) / (1 - transaction_fee)
+            multiplier:  coin_price > price * ratio / (1 - transaction_fee * SCOUT_MULTIPLIER)
+
+        nan for pairs without price or ratio, inf for pairs whose fees can never be earned back
+        """
+        if self.config.USE_MARGIN:
+            factors = (1 - transaction_fees) / (1 + self.config.SCOUT_MARGIN / 100)
+        else:
+            factors = 1 - transaction_fees * self.config.SCOUT_MULTIPLIER
+        with np.errstate(divide="ignore", invalid="ignore"):
+            triggers = prices * ratios / factors
+        triggers[(factors <= 0) & ~np.isnan(triggers)] = np.inf
+        return triggers
+
+    def candidate_index(self, coin: Coin, pairs: List[Pair]) -> CandidateIndex:
+        """
+        The up to date candidate index of coin. Only pairs whose candidate price changed since the last call are
+        updated, the index is rebuilt when the pairs or the fees changed. The candidate prices are only read again
+        if the price board changed since, the changes found by the refreshes of other coins are applied either way.
+        """
+        from_slot = self.coin_slot(coin.symbol)
+        to_slots, pair_array = self.load_pairs(coin, pairs)
+        self._validate_fees()
+        # taken before the prices are read, a batch written meanwhile makes the next call read them again
+        board_sequence = self.manager.get_price_board_sequence()
+
+        index = self._indexes.get(from_slot)
+        if index is None or index.pairs is not pairs or index.seen < self._price_changes_start:
+            on_board = self.refresh_prices(to_slots)
+            triggers = self._trigger_prices(
+                self.prices[to_slots], self.ratios[from_slot, to_slots], self._transaction_fees(coin, to_slots)
+            )
+            changes_end = self._price_changes_start + len(self._price_changes)
+            index = CandidateIndex(pairs, to_slots, pair_array, triggers, changes_end)
+            self._indexes[from_slot] = index
+        else:
+            on_board = index.board_sequence == board_sequence or self.refresh_prices(to_slots)
+            changes_end = self._price_changes_start + len(self._price_changes)
+            positions = index.positions
+            changed = {
+                positions[slot]
+                for slot in self._price_changes[index.seen - self._price_changes_start :]
+                if slot in positions
+            }
+            if changed:
+                changed = np.fromiter(changed, dtype=np.intp, count=len(changed))
+                changed_slots = to_slots[changed]
+                triggers = self._trigger_prices(
+                    self.prices[changed_slots],
+                    self.ratios[from_slot, changed_slots],
+                    self._transaction_fees(coin, changed_slots),
+                )
+                for position, trigger in zip(changed.tolist(), triggers.tolist()):
+                    index.update(position, trigger)
+            index.seen = changes_end
+        index.board_sequence = board_sequence if on_board else None
+
+        # indexes that are behind a trimmed log are rebuilt on their next use
+        if len(self._price_changes) > 4 * len(self.symbols) + 1024:
+            self._price_changes_start = changes_end
+            self._price_changes = []
+        return index
+
+    def _excluded_slots(self, excluded_symbols: List[str]):
+        return {self.coin_index[symbol] for symbol in excluded_symbols if symbol in self.coin_index}
+
+    def best_candidate(
+        self, coin: Coin, coin_price: float, index: CandidateIndex, excluded_symbols: List[str] = ()
+    ) -> Optional[Tuple[Pair, float, float]]:
+        """
+        The best pair of the index that scores positive at coin_price, with its candidate price and its score.
+        None if no pair crossed its trigger price.
+        """
+        position = index.best(self._excluded_slots(excluded_symbols))
+        if position is None or not coin_price > index.triggers[position]:
+            return None
+        to_slot = index.to_slots[position : position + 1]
+        prices = self.prices[to_slot]
+        score = self._scores(
+            coin_price, prices, self.ratios[self.coin_slot(coin.symbol), to_slot], self._transaction_fees(coin, to_slot)
+        )[0]
+        return index.pair_array[position], float(prices[0]), float(score)
+
+    def ranked_candidates(
+        self,
+        coin: Coin,
+        coin_price: float,
+        index: CandidateIndex,
+        best: int,
+        worst: int,
+        excluded_symbols: List[str] = (),
+    ) -> Tuple[ScoutScores, ScoutScores]:
+        """
+        The best and the worst scoring pairs of the index, best first respectively worst first, without sorting
+        all of them
+        """
+        positions = np.flatnonzero(~np.isnan(index.triggers))
+        if excluded_symbols:
+            excluded_slots = list(self._excluded_slots(excluded_symbols))
+            positions = positions[~np.isin(index.to_slots[positions], excluded_slots)]
+        triggers = index.triggers[positions]
+
+        # a lower trigger price is a better score
+        if len(positions) > best:
+            best_positions = positions[np.argpartition(triggers, best - 1)[:best]] if best else positions[:0]
+        else:
+            best_positions = positions
+        if len(positions) > worst:
+            worst_positions = positions[np.argpartition(triggers, len(positions) - worst)[len(positions) - worst :]]
+        else:
+            worst_positions = positions
+
+        from_slot = self.coin_slot(coin.symbol)
+        ranked = []
+        for selected, reverse in ((best_positions, True), (worst_positions, False)):
+            to_slots = index.to_slots[selected]
+            prices = self.prices[to_slots]
+            scores = self._scores(
+                coin_price, prices, self.ratios[from_slot, to_slots], self._transaction_fees(coin, to_slots)
+            )
+            order = np.argsort(-scores if reverse else scores, kind="stable")
+            ranked.append(ScoutScores(index.pair_array[selected][order].tolist(), prices[order], scores[order], []))
+        return ranked[0], ranked[1]
+
+    def candidate_prices(
+        self, coin: Coin, index: CandidateIndex, excluded_symbols: List[str] = ()
+    ) -> Tuple[Dict[Pair, Tuple[Optional[float], float]], List[Pair]]:
+        """
+        The ratios and known candidate prices of the pairs of the index and the pairs whose candidate price is unknown
+        """
+        pair_array = index.pair_array
+        to_slots = index.to_slots
+        if excluded_symbols:
+            included = ~np.isin(to_slots, list(self._excluded_slots(excluded_symbols)))
+            pair_array = pair_array[included]
+            to_slots = to_slots[included]
+        prices = self.prices[to_slots]
+        priced = ~np.isnan(prices)
+        ratios = self.ratios[self.coin_slot(coin.symbol), to_slots[priced]]
+        ratios = [None if ratio != ratio else ratio for ratio in ratios.tolist()]
+        return (
+            dict(zip(pair_array[priced].tolist(), zip(ratios, prices[priced].tolist()))),
+            pair_array[~priced].tolist(),
+        )
@@ -31,3 +31,10 @@ class SafeScheduler(Scheduler):
                 # letting it run
                 # next tick
                 job._schedule_next_run()  # pylint: disable=protected-access
+
+    def run_tagged(self, tag: str):
+        """
+        Run the jobs with the given tag right away, their next scheduled run is counted from now
+        """
+        for job in self.get_jobs(tag):
+            self._run_job(job)
@@ -0,0 +1,166 @@
+from datetime import datetime
+from typing import Callable, List
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from .logger import Logger
+from .models import Base, CoinValue, CurrentCoin, Pair, ScoutHistory, Trade
+from .scout_history_partitions import ScoutHistoryPartitions
+
+
+# the tables version 1 added the indexes of
+VERSION_1_INDEXED_TABLES = (
+    Pair.__table__,
+    ScoutHistory.__table__,
+    CoinValue.__table__,
+    Trade.__table__,
+    CurrentCoin.__table__,
+)
+
+
+def _add_indexes(connection: Connection):
+    """
+    Index the columns the prunes and the api server filter and sort by, and make pairs unique
+    """
+    # pairs were never unique, move the history of duplicates over to the oldest one and drop the rest
+    duplicates = connection.execute(
+        text(
+            "SELECT pairs.id, kept.id FROM pairs JOIN ("
+            " SELECT min(id) AS id, from_coin_id, to_coin_id FROM pairs GROUP BY from_coin_id, to_coin_id"
+            ") AS kept ON pairs.from_coin_id = kept.from_coin_id AND pairs.to_coin_id = kept.to_coin_id"
+            " WHERE pairs.id != kept.id"
+        )
+    ).fetchall()
+    for duplicate_id, kept_id in duplicates:
+        connection.execute(
+            text("UPDATE scout_history SET pair_id = :kept_id WHERE pair_id = :duplicate_id"),
+            {"kept_id": kept_id, "duplicate_id": duplicate_id},
+        )
+        # at most one rollup per pair and minute, the ones of the duplicate can't be merged in
+        connection.execute(
+            text("DELETE FROM scout_history_rollups WHERE pair_id = :duplicate_id"), {"duplicate_id": duplicate_id}
+        )
+        connection.execute(text("DELETE FROM pairs WHERE id = :duplicate_id"), {"duplicate_id": duplicate_id})
+
+    for table in VERSION_1_INDEXED_TABLES:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _enable_incremental_vacuum(connection: Connection):
+    """
+    Let the pages freed by the prunes be given back to the file system without rebuilding the database every time
+    """
+    if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        # only takes effect once the database is rebuilt
+        connection.exec_driver_sql("VACUUM")
+
+
+def _roll_up_value_history(connection: Connection):
+    """
+    Values are rolled up when they are written from now on. Before, the prune rolled them up, so the ones since
+    the last prune are still minutely: make the first value of every coin and hour, day and week that has none
+    yet the hourly, daily and weekly one
+    """
+    for interval, dt_format, finer_intervals in (
+        ("HOURLY", "%Y-%j %H", ("MINUTELY",)),
+        ("DAILY", "%Y-%j", ("MINUTELY", "HOURLY")),
+        ("WEEKLY", "%Y-%W", ("MINUTELY", "HOURLY", "DAILY")),
+    ):
+        finer = ", ".join(f"'{finer_interval}'" for finer_interval in finer_intervals)
+        # with a single min() SQLite returns the other columns from the row it picked
+        connection.execute(
+            text(
+                f"UPDATE coin_value SET interval = '{interval}' WHERE id IN ("
+                " SELECT id FROM ("
+                f"  SELECT id, interval, min(datetime), sum(interval NOT IN ({finer})) AS coarser FROM coin_value"
+                f"  GROUP BY coin_id, strftime('{dt_format}', datetime)"
+                f" ) WHERE interval IN ({finer}) AND coarser = 0"
+                ")"
+            )
+        )
+
+
+def _partition_scout_history(connection: Connection):
+    """
+    Move the scout history into hourly partitions. Newer partitions use scout_history_partition_minutes, the
+    partitions of different lengths are kept in order by their starts
+    """
+    legacy_table = ScoutHistory.__table__
+    if not inspect(connection).has_table(legacy_table.name):
+        return
+    partitions = ScoutHistoryPartitions(60)
+    columns = ["pair_id", "target_ratio", "current_coin_price", "other_coin_price", "datetime"]
+    hour_of_scout = func.strftime("%Y-%m-%d %H", legacy_table.c.datetime)
+    hours = connection.execute(select(hour_of_scout).where(hour_of_scout.isnot(None)).distinct()).fetchall()
+    for (hour,) in hours:
+        partition = partitions.table(datetime.strptime(hour, "%Y-%m-%d %H"))
+        partition.create(connection, checkfirst=True)
+        connection.execute(
+            partition.insert().from_select(
+                columns,
+                select(*[legacy_table.c[column] for column in columns])
+                .where(hour_of_scout == hour)
+                .order_by(legacy_table.c.datetime),
+            )
+        )
+    legacy_table.drop(connection)
+
+
+# SCHEMA_UPGRADES[n] brings a database from version n to n + 1. Only ever append
+SCHEMA_UPGRADES: List[Callable[[Connection], None]] = [
+    _add_indexes,
+    _enable_incremental_vacuum,
+    _roll_up_value_history,
+    _partition_scout_history,
+]
+# upgrades SQLite can't run inside a transaction
+_AUTOCOMMIT_UPGRADES = {_enable_incremental_vacuum}
+SCHEMA_VERSION = len(SCHEMA_UPGRADES)
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_schema_version(connection: Connection, version: int):
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def upgrade_schema(engine: Engine, logger: Logger):
+    """
+    Create the missing tables and run the upgrades the database hasn't seen yet, one transaction each.
+    A database created from scratch has the current schema already and only gets the version set
+    """
+    is_new_database = not inspect(engine).has_table(Pair.__tablename__)
+    if is_new_database:
+        # the new database skips the upgrade of version 2, still empty the VACUUM costs nothing
+        with engine.connect() as connection:
+            _enable_incremental_vacuum(connection.execution_options(isolation_level="AUTOCOMMIT"))
+    # the scout history lives in partitions, ScoutHistory only maps the table databases before version 4 had
+    Base.metadata.create_all(
+        engine, tables=[table for table in Base.metadata.sorted_tables if table is not ScoutHistory.__table__]
+    )
+
+    with engine.begin() as connection:
+        version = SCHEMA_VERSION if is_new_database else get_schema_version(connection)
+        if is_new_database:
+            set_schema_version(connection, version)
+
+    if version > SCHEMA_VERSION:
+        logger.warning(
+            f"Database schema version {version} is newer than this version of the bot ({SCHEMA_VERSION})",
+            notification=False,
+        )
+
+    for upgrade_version in range(version, SCHEMA_VERSION):
+        logger.info(f"Upgrading database schema to version {upgrade_version + 1}", notification=False)
+        upgrade = SCHEMA_UPGRADES[upgrade_version]
+        with engine.connect() as connection:
+            if upgrade in _AUTOCOMMIT_UPGRADES:
+                connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+            with connection.begin():
+                upgrade(connection)
+                set_schema_version(connection, upgrade_version + 1)
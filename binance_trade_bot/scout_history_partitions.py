@@ -0,0 +1,111 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, select, text, union_all
+from sqlalchemy.engine import Connection
+
+PARTITION_PREFIX = "scout_history_"
+_EPOCH = datetime(1970, 1, 1)
+_START_FORMAT = "%Y%m%d%H%M"
+
+
+class ScoutHistoryPartitions:
+    """
+    The scout history is split into one table per partition_minutes, named after the start of its period, so
+    pruning it drops whole tables instead of deleting rows.
+
+    A partition ends where the next one starts, or one partition length after its own start if that is later, so
+    partitions written with a different partition length before are kept for long enough.
+    """
+
+    def __init__(self, partition_minutes: float):
+        self.length = timedelta(minutes=partition_minutes)
+        self._metadata = MetaData()
+        self._tables: Dict[datetime, Table] = {}
+        self._created: Set[datetime] = set()
+        self._lock = threading.Lock()
+
+    def partition_start(self, dt: datetime) -> datetime:
+        return _EPOCH + (dt - _EPOCH) // self.length * self.length
+
+    def table(self, start: datetime) -> Table:
+        with self._lock:
+            table = self._tables.get(start)
+            if table is None:
+                name = f"{PARTITION_PREFIX}{start.strftime(_START_FORMAT)}"
+                table = Table(
+                    name,
+                    self._metadata,
+                    Column("id", Integer, primary_key=True),
+                    Column("pair_id", String),
+                    Column("target_ratio", Float),
+                    Column("current_coin_price", Float),
+                    Column("other_coin_price", Float),
+                    Column("datetime", DateTime, index=True),
+                )
+                self._tables[start] = table
+            return table
+
+    def live(self, connection: Connection) -> List[Tuple[datetime, Optional[datetime], Table]]:
+        """
+        (start, end, table) of the partitions in the database, oldest first. The newest one has no end yet
+        """
+        starts = []
+        for (name,) in connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"),
+            {"prefix": f"{PARTITION_PREFIX}%"},
+        ):
+            suffix = name[len(PARTITION_PREFIX) :]
+            if len(suffix) == len("YYYYmmddHHMM") and suffix.isdigit():
+                starts.append(datetime.strptime(suffix, _START_FORMAT))
+        starts.sort()
+        ends = [max(next_start, start + self.length) for start, next_start in zip(starts, starts[1:])] + [None]
+        return [(start, end, self.table(start)) for start, end in zip(starts, ends)]
+
+    def insert(self, connection: Connection, rows: List[dict]):
+        """
+        Insert the rows into the partitions of their datetimes, creating the partitions that don't exist yet
+        """
+        partition_rows: Dict[datetime, List[dict]] = {}
+        for row in rows:
+            partition_rows.setdefault(self.partition_start(row["datetime"]), []).append(row)
+        for start, rows_of_partition in partition_rows.items():
+            table = self.table(start)
+            with self._lock:
+                if start not in self._created:
+                    table.create(connection, checkfirst=True)
+                    self._created.add(start)
+            connection.execute(table.insert(), rows_of_partition)
+
+    def drop_before(self, connection: Connection, dt: datetime) -> int:
+        """
+        Drop the partitions that only hold scouts from before dt, returns how many were dropped
+        """
+        dropped = 0
+        for start, end, table in self.live(connection):
+            if (end if end is not None else start + self.length) > dt:
+                break
+            with self._lock:
+                table.drop(connection)
+                self._created.discard(start)
+            dropped += 1
+        return dropped
+
+    def select(self, connection: Connection, pair_ids: Iterable[int], since: Optional[datetime] = None):
+        """
+        The scouts of the pairs since the given datetime from all the partitions, oldest first
+        """
+        pair_ids = [str(pair_id) for pair_id in pair_ids]
+        queries = []
+        for start, end, table in self.live(connection):
+            if since is not None and end is not None and end <= since:
+                continue
+            query = select(table).where(table.c.pair_id.in_(pair_ids))
+            if since is not None:
+                query = query.where(table.c.datetime >= since)
+            queries.append(query)
+        if not queries:
+            return []
+        query = union_all(*queries) if len(queries) > 1 else queries[0]
+        return connection.execute(query.order_by("datetime")).fetchall()
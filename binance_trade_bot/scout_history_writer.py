@@ -0,0 +1,91 @@
+import threading
+from typing import Callable, Dict, List
+
+from .logger import Logger
+
+
+class ScoutHistoryWriter:
+    """
+    Writes the scout history from a background thread, so scouting never waits on the database.
+
+    Rows of all the scouts since the last flush are written in one transaction every flush_interval seconds.
+    At most max_pending_rows rows are kept in memory. When a scout would exceed that, the pending rows are
+    merged first: only the newest row of every pair is kept, older samples of the same pair are dropped. If
+    that still isn't enough, the oldest rows are dropped. Both are counted and logged.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[Dict]], None],
+        logger: Logger,
+        max_pending_rows: int,
+        flush_interval: float,
+    ):
+        self.write = write
+        self.logger = logger
+        self.max_pending_rows = max_pending_rows
+        self.flush_interval = flush_interval
+        self._condition = threading.Condition()
+        self._pending: List[Dict] = []
+        self._merged = 0
+        self._dropped = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="scout_history_writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, rows: List[Dict]):
+        with self._condition:
+            if not self._closed:
+                self._pending.extend(rows)
+                if len(self._pending) > self.max_pending_rows:
+                    self._shrink()
+                return
+        # late scouts during shutdown are written right away
+        self.write(rows)
+
+    def _shrink(self):
+        newest: Dict[str, Dict] = {}
+        for row in reversed(self._pending):
+            newest.setdefault(row["pair_id"], row)
+        rows = list(reversed(newest.values()))
+        self._merged += len(self._pending) - len(rows)
+        if len(rows) > self.max_pending_rows:
+            self._dropped += len(rows) - self.max_pending_rows
+            rows = rows[len(rows) - self.max_pending_rows :]
+        self._pending = rows
+
+    def close(self):
+        """
+        Write everything that is still pending and stop the thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        elif self._pending:
+            self.write(self._pending)
+            self._pending = []
+
+    def _run(self):
+        closed = False
+        while not closed:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed, self.flush_interval)
+                closed = self._closed
+                rows, self._pending = self._pending, []
+                merged, self._merged = self._merged, 0
+                dropped, self._dropped = self._dropped, 0
+
+            if merged or dropped:
+                self.logger.warning(
+                    f"Scout history can't keep up: merged {merged} and dropped {dropped} rows", notification=False
+                )
+            if not rows:
+                continue
+            try:
+                self.write(rows)
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.error(f"Couldn't write {len(rows)} scout history rows: {e}", notification=False)
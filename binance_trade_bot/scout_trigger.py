@@ -0,0 +1,56 @@
+import threading
+import time
+from typing import Iterable, Set
+
+
+class ScoutTrigger:
+    """
+    Wakes the scouting loop up as soon as a price the scout depends on changed, instead of waiting for the
+    next SCOUT_SLEEP_TIME tick.
+
+    Bursts of ticks are debounced into a single scout, and scouts are never started more often than max_rate
+    times per second.
+    """
+
+    def __init__(self, debounce: float, max_rate: float):
+        self.debounce = debounce
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0
+        self._condition = threading.Condition()
+        self._pending = False
+        self._watched_symbols: Set[str] = set()
+        self._last_scout = 0.0
+
+    def watch(self, symbols: Iterable[str]):
+        """
+        Set the ticker symbols whose price changes should trigger a scout
+        """
+        self._watched_symbols = set(symbols)
+
+    def price_changed(self, symbol: str):
+        if symbol in self._watched_symbols:
+            self.notify()
+
+    def notify(self):
+        with self._condition:
+            self._pending = True
+            self._condition.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until a scout is due or timeout passed. Returns whether the caller should scout now
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._pending, timeout):
+                return False
+
+        # give the rest of a burst the chance to arrive, it will be handled by this very scout
+        if self.debounce > 0:
+            time.sleep(self.debounce)
+        delay = self._last_scout + self.min_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._condition:
+            self._pending = False
+        self._last_scout = time.monotonic()
+        return True
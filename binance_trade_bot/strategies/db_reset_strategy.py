@@ -1,6 +1,7 @@
 from binance_trade_bot.models import trade
 import random
 import sys
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from sqlalchemy.orm import Session, aliased
 from sqlalchemy.sql.expression import and_
@@ -115,34 +116,48 @@ class Strategy(AutoTrader):
         """
         #updates all ratios
         print('************INITIALIZING RATIOS**********')
+        grouped_pairs = defaultdict(list)
         session: Session
         with self.db.db_session() as session:
             c1 = aliased(Coin)
             c2 = aliased(Coin)
-            for pair in session.query(Pair).\
+            for pair_id, from_coin_symbol, to_coin_symbol in session.query(Pair.id, Pair.from_coin_id, Pair.to_coin_id).\
                 join(c1, and_(Pair.from_coin_id == c1.symbol, c1.enabled == True)).\
-                join(c2, and_(Pair.to_coin_id == c2.symbol, c2.enabled == True)).\
-                all():
-                if not pair.from_coin.enabled or not pair.to_coin.enabled:
-                    continue
-                self.logger.info(f"Initializing {pair.from_coin} vs {pair.to_coin}", False)
-
-                from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
-                if from_coin_price is None:
-                    self.logger.info(
-                        "Skipping initializing {}, symbol not found".format(pair.from_coin + self.config.BRIDGE),
-                        False
-                    )
-                    continue
+                join(c2, and_(Pair.to_coin_id == c2.symbol, c2.enabled == True)):
+                grouped_pairs[from_coin_symbol].append((pair_id, to_coin_symbol))
+
+        # every coin is priced once, not once per pair it is part of
+        sell_prices = {}
+        buy_prices = {}
+        for symbol in set(grouped_pairs) | {to_symbol for group in grouped_pairs.values() for _, to_symbol in group}:
+            if symbol in grouped_pairs:
+                sell_prices[symbol] = self.manager.get_sell_price(symbol + self.config.BRIDGE.symbol)
+            buy_prices[symbol] = self.manager.get_buy_price(symbol + self.config.BRIDGE.symbol)
+
+        pair_ids, ratios, from_coin_prices, to_coin_prices = [], [], [], []
+        for from_coin_symbol, group in grouped_pairs.items():
+            self.logger.info(f"Initializing {from_coin_symbol} vs [{', '.join([symbol for _, symbol in group])}]", False)
+
+            from_coin_price = sell_prices[from_coin_symbol]
+            if from_coin_price is None:
+                self.logger.info(
+                    "Skipping initializing {}, symbol not found".format(from_coin_symbol + self.config.BRIDGE.symbol),
+                    False
+                )
+                continue
 
-                to_coin_price = self.manager.get_buy_price(pair.to_coin + self.config.BRIDGE)
+            for pair_id, to_coin_symbol in group:
+                to_coin_price = buy_prices[to_coin_symbol]
                 if to_coin_price is None:
                     self.logger.info(
-                        "Skipping initializing {}, symbol not found".format(pair.to_coin + self.config.BRIDGE),
+                        "Skipping initializing {}, symbol not found".format(to_coin_symbol + self.config.BRIDGE.symbol),
                         False
                     )
                     continue
 
-                pair.ratio = from_coin_price / to_coin_price
-                pair.from_coin_price = from_coin_price
-                pair.to_coin_price = to_coin_price
+                pair_ids.append(pair_id)
+                ratios.append(from_coin_price / to_coin_price)
+                from_coin_prices.append(from_coin_price)
+                to_coin_prices.append(to_coin_price)
+
+        self.db.bulk_update_pair_ratios(pair_ids, ratios, from_coin_prices, to_coin_prices)
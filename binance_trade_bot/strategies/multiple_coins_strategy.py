@@ -1,9 +1,15 @@
 from datetime import datetime
+from typing import List, Optional
 
 from binance_trade_bot.auto_trader import AutoTrader
 
 
 class Strategy(AutoTrader):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # symbols of the coins we hold any balance of, rescanned only after the balances changed
+        self.held_coin_symbols: Optional[List[str]] = None
+
     def scout(self):
         """
         Scout for potential jumps from the current coin to another coin
@@ -35,10 +41,27 @@ class Strategy(AutoTrader):
             self.logger.info("No active coin found. Going to buy one. If you want to have more than one coin you just need to buy coins from your coinlist.")
             self.bridge_scout()
 
+    def get_held_coin_symbols(self) -> List[str]:
+        balances_changed = self.manager.cache.balances_changed_event
+        if self.held_coin_symbols is None or balances_changed.is_set():
+            # clear first, a change that arrives during the scan marks the set dirty again
+            balances_changed.clear()
+            self.held_coin_symbols = [
+                coin.symbol for coin in self.db.get_coins(True) if self.manager.get_currency_balance(coin.symbol) > 0
+            ]
+        return self.held_coin_symbols
+
     def get_active_coins(self):
+        """
+        The coins whose balance is worth more than the min notional. Only held coins are checked, against the
+        current price, so price changes are picked up without rescanning all the balances.
+        """
         active_coins = []
 
-        for coin in self.db.get_coins(True):
+        for symbol in self.get_held_coin_symbols():
+            coin = self.db.get_coin(symbol)
+            if coin is None or not coin.enabled:
+                continue
             current_coin_balance = self.manager.get_currency_balance(coin.symbol)
             coin_price = self.manager.get_sell_price(coin + self.config.BRIDGE)
 
@@ -60,28 +83,20 @@ class Strategy(AutoTrader):
 
         active_coins = self.get_active_coins()
         active_coin_symbols = [c.symbol for c in active_coins]
-        for coin in self.db.get_coins():
-            #skip active coins, we dont want coin fusion
-            if coin.symbol in active_coin_symbols:
-                continue
-
-            current_coin_price = self.manager.get_sell_price(coin + self.config.BRIDGE)
-
-            if current_coin_price is None:
-                continue
-
-            ratio_dict, _prices, ratio_debug = self._get_ratios(coin, current_coin_price, active_coins)
-            if not any(v > 0 for v in ratio_dict.values()):
-                # There will only be one coin where all the ratios are negative. When we find it, buy it if we can
-                if bridge_balance > self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol):
-                    self.logger.info(f"Will be purchasing {coin} using bridge coin")
-                    result = self.manager.buy_alt(
-                        coin, self.config.BRIDGE, self.manager.get_sell_price(coin + self.config.BRIDGE)
-                    )
-                    if result is not None:
-                        self.db.set_current_coin(coin)
-                        self.failed_buy_order = False
-                        return coin
-                    else:
-                        self.failed_buy_order = True
+        #skip active coins, we dont want coin fusion
+        coins = [coin for coin in self.db.get_coins() if coin.symbol not in active_coin_symbols]
+
+        for coin in self._get_bridge_scout_targets(coins, active_coins):
+            # There will only be one coin where all the ratios are negative. When we find it, buy it if we can
+            if bridge_balance > self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol):
+                self.logger.info(f"Will be purchasing {coin} using bridge coin")
+                result = self.manager.buy_alt(
+                    coin, self.config.BRIDGE, self.manager.get_sell_price(coin + self.config.BRIDGE)
+                )
+                if result is not None:
+                    self.db.set_current_coin(coin)
+                    self.failed_buy_order = False
+                    return coin
+                else:
+                    self.failed_buy_order = True
         return None
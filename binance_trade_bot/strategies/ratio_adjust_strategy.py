@@ -1,13 +1,18 @@
 from collections import defaultdict
 import random
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from threading import Thread
+from typing import Dict, Iterable, Optional
 
+import numpy as np
 from sqlalchemy.orm import Session, aliased
 from sqlalchemy.sql.expression import and_
 
 from binance_trade_bot.auto_trader import AutoTrader
 from binance_trade_bot.database import Pair, Coin
+from binance_trade_bot.rate_limiter import RequestWeightLimiter, historical_klines_request_weight
 
 class Strategy(AutoTrader):
     def initialize(self):
@@ -17,9 +22,11 @@ class Strategy(AutoTrader):
             self.logger.error("You need accept losses by setting accept_losses=true in the user.cfg or setting the enviroment variable ACCEPT_LOSSES to true in order to use this strategy!")
             raise Exception()
 
+        self.flush_thread: Optional[Thread] = None
         super().initialize()
         self.initialize_current_coin()
         self.reinit_threshold = self.manager.now().replace(second=0, microsecond=0)
+        self.flush_threshold = self.reinit_threshold + timedelta(minutes=self.config.RATIO_ADJUST_FLUSH_MINUTES)
         self.logger.info(f"Ratio adjust weight: {self.config.RATIO_ADJUST_WEIGHT}")
 
     def scout(self):
@@ -32,6 +39,9 @@ class Strategy(AutoTrader):
         if base_time >= allowed_idle_time:
             self.re_initialize_trade_thresholds()
             self.reinit_threshold = self.manager.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+        if base_time >= self.flush_threshold:
+            self.flush_trade_thresholds()
+            self.flush_threshold = base_time + timedelta(minutes=self.config.RATIO_ADJUST_FLUSH_MINUTES)
 
         """
         Scout for potential jumps from the current coin to another coin
@@ -102,105 +112,128 @@ class Strategy(AutoTrader):
         """
         Re-initialize all the thresholds ( hard reset - as deleting db )
         """
-        #updates all ratios
-        #print('************INITIALIZING RATIOS**********')
-        session: Session
-        with self.db.db_session() as session:
-            c1 = aliased(Coin)
-            c2 = aliased(Coin)
-            for pair in session.query(Pair).all():
-                if not pair.from_coin.enabled or not pair.to_coin.enabled:
-                    continue
-                # self.logger.info(f"Initializing {pair.from_coin} vs {pair.to_coin}")
-
-                from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
-                if from_coin_price is None:
-                    # self.logger.debug(
-                    #     "Skipping initializing {}, symbol not found".format(pair.from_coin + self.config.BRIDGE),
-                    #     False
-                    # )
-                    continue
+        # updates all ratios in memory, flush_trade_thresholds writes them to the database
+        coins = self.db.get_coins()
+        self.scoring_engine.adjust_ratios(
+            coins, [self.db.get_pairs_from(coin) for coin in coins], self.config.RATIO_ADJUST_WEIGHT
+        )
 
-                to_coin_price = self.manager.get_buy_price(pair.to_coin + self.config.BRIDGE)
-                if to_coin_price is None:
-                    # self.logger.debug(
-                    #     "Skipping initializing {}, symbol not found".format(pair.to_coin + self.config.BRIDGE),
-                    #     False
-                    # )
-                    continue
+    def flush_trade_thresholds(self, wait=False):
+        """
+        Write the ratios adjusted in memory to the database, from a background thread unless wait is set
+        """
+        if self.flush_thread is not None and self.flush_thread.is_alive():
+            if not wait:
+                # the previous flush is still running, its successor will take the ratios along
+                return
+            self.flush_thread.join()
+
+        dirty_ratios = self.scoring_engine.take_dirty_ratios()
+        if wait or self.db.is_memory_database():
+            self._write_ratios(dirty_ratios)
+        else:
+            self.flush_thread = Thread(target=self._write_ratios, args=(dirty_ratios,), daemon=True)
+            self.flush_thread.start()
+
+    def _write_ratios(self, dirty_ratios):
+        """
+        Write the ratios taken from the scoring engine and tell it whether they were committed
+        """
+        flushed = False
+        try:
+            self.db.bulk_update_pair_ratios(*dirty_ratios)
+            flushed = True
+        finally:
+            self.scoring_engine.finish_flush(flushed)
 
-                if pair.ratio is None:
-                    continue
+    def update_trade_threshold(self, coin: Coin, coin_price: float):
+        # write the adjusted ratios first, so the thresholds written now are the newest ones
+        self.flush_trade_thresholds(True)
+        super().update_trade_threshold(coin, coin_price)
 
-                pair.ratio = (pair.ratio * self.config.RATIO_ADJUST_WEIGHT + from_coin_price / to_coin_price)  / (self.config.RATIO_ADJUST_WEIGHT + 1)
-                pair.from_coin_price = from_coin_price
-                pair.to_coin_price = to_coin_price
+    def close(self):
+        self.flush_trade_thresholds(True)
 
     def initialize_trade_thresholds(self):
         """
         Initialize the buying threshold of all the coins for trading between them
         """
-        session: Session
-        with self.db.db_session() as session:
-            pairs = session.query(Pair).filter(Pair.ratio.is_(None)).all()
-            grouped_pairs = defaultdict(list)
-            for pair in pairs:
-                if pair.from_coin.enabled and pair.to_coin.enabled:
-                    grouped_pairs[pair.from_coin.symbol].append(pair)
-
-            price_history = {}
-
-            init_weight = self.config.RATIO_ADJUST_WEIGHT
-
-            #Binance api allows retrieving max 1000 candles
-            if init_weight > 500:
-                init_weight = 500
-
-            self.logger.info(f"Using last {init_weight} candles to initialize ratios")
-
-            base_date = self.manager.now().replace(second=0, microsecond=0)
-            start_date = base_date - timedelta(minutes=init_weight*2)
-            end_date = base_date - timedelta(minutes=1)
-
-            start_date_str = start_date.strftime('%Y-%m-%d %H:%M')
-            end_date_str = end_date.strftime('%Y-%m-%d %H:%M')
-
-            self.logger.info(f"Starting ratio init: Start Date: {start_date}, End Date {end_date}")
-            for from_coin_symbol, group in grouped_pairs.items():
-
-                if from_coin_symbol not in price_history.keys():
-                    price_history[from_coin_symbol] = []
-                    for result in  self.manager.binance_client.get_historical_klines(f"{from_coin_symbol}{self.config.BRIDGE_SYMBOL}", "1m", start_date_str, end_date_str, limit=init_weight*2):
-                        price = float(result[1])
-                        price_history[from_coin_symbol].append(price)
-
-                for pair in group:                  
-                    to_coin_symbol = pair.to_coin.symbol
-                    if to_coin_symbol not in price_history.keys():
-                        price_history[to_coin_symbol] = []
-                        for result in self.manager.binance_client.get_historical_klines(f"{to_coin_symbol}{self.config.BRIDGE_SYMBOL}", "1m", start_date_str, end_date_str, limit=init_weight*2):                           
-                           price = float(result[1])
-                           price_history[to_coin_symbol].append(price)
-
-                    if len(price_history[from_coin_symbol]) != init_weight*2:
-                        self.logger.info(len(price_history[from_coin_symbol]))
-                        self.logger.info(f"Skip initialization. Could not fetch last {init_weight * 2} prices for {from_coin_symbol}")
-                        continue
-                    if len(price_history[to_coin_symbol]) != init_weight*2:
-                        self.logger.info(f"Skip initialization. Could not fetch last {init_weight * 2} prices for {to_coin_symbol}")
-                        continue
-                    
-                    sma_ratio = 0.0
-                    for i in range(init_weight):
-                        sma_ratio += price_history[from_coin_symbol][i] / price_history[to_coin_symbol][i]
-                    sma_ratio = sma_ratio / init_weight
-
-                    cumulative_ratio = sma_ratio
-                    for i in range(init_weight, init_weight * 2):
-                        cumulative_ratio = (cumulative_ratio * init_weight + price_history[from_coin_symbol][i] / price_history[to_coin_symbol][i]) / (init_weight + 1)
-
-                    pair.ratio = cumulative_ratio
-                    pair.from_coin_price = None
-                    pair.to_coin_price = None
-
-            self.logger.info(f"Finished ratio init...")
+        grouped_pairs = self._get_uninitialized_pairs()
+
+        init_weight = self.config.RATIO_ADJUST_WEIGHT
+
+        #Binance api allows retrieving max 1000 candles
+        if init_weight > 500:
+            init_weight = 500
+
+        self.logger.info(f"Using last {init_weight} candles to initialize ratios")
+
+        base_date = self.manager.now().replace(second=0, microsecond=0)
+        start_date = base_date - timedelta(minutes=init_weight*2)
+        end_date = base_date - timedelta(minutes=1)
+
+        start_date_str = start_date.strftime('%Y-%m-%d %H:%M')
+        end_date_str = end_date.strftime('%Y-%m-%d %H:%M')
+
+        self.logger.info(f"Starting ratio init: Start Date: {start_date}, End Date {end_date}")
+        symbols = set(grouped_pairs)
+        symbols.update(to_coin_symbol for group in grouped_pairs.values() for _, to_coin_symbol in group)
+        price_history = self._fetch_price_history(symbols, start_date_str, end_date_str, init_weight * 2)
+
+        # weight of every ratio of the second half in the recursive weighted average
+        #   cumulative_ratio = (cumulative_ratio * init_weight + ratio) / (init_weight + 1)
+        # which starts from the simple moving average of the first half
+        decay = init_weight / (init_weight + 1)
+        weights = decay ** np.arange(init_weight - 1, -1, -1) / (init_weight + 1)
+
+        pair_ids, pair_ratios = [], []
+        for from_coin_symbol, group in grouped_pairs.items():
+            if len(price_history[from_coin_symbol]) != init_weight*2:
+                self.logger.info(len(price_history[from_coin_symbol]))
+                self.logger.info(f"Skip initialization. Could not fetch last {init_weight * 2} prices for {from_coin_symbol}")
+                continue
+
+            pairs = []
+            for pair_id, to_coin_symbol in group:
+                if len(price_history[to_coin_symbol]) != init_weight*2:
+                    self.logger.info(f"Skip initialization. Could not fetch last {init_weight * 2} prices for {to_coin_symbol}")
+                    continue
+                pairs.append((pair_id, to_coin_symbol))
+            if not pairs:
+                continue
+
+            ratios = price_history[from_coin_symbol] / np.array([price_history[symbol] for _, symbol in pairs])
+            sma_ratios = ratios[:, :init_weight].mean(axis=1)
+            cumulative_ratios = sma_ratios * decay ** init_weight + ratios[:, init_weight:] @ weights
+
+            pair_ids.extend(pair_id for pair_id, _ in pairs)
+            pair_ratios.extend(cumulative_ratios.tolist())
+
+        self.db.bulk_update_pair_ratios(pair_ids, pair_ratios, [None] * len(pair_ids), [None] * len(pair_ids))
+
+        self.logger.info(f"Finished ratio init...")
+
+    def _fetch_price_history(
+        self, symbols: Iterable[str], start_date_str: str, end_date_str: str, limit: int
+    ) -> Dict[str, np.ndarray]:
+        """
+        Fetch the 1m open prices of all symbols concurrently, without exceeding the request weight budget. A symbol
+        whose prices can't be fetched gets none, its ratios aren't initialized
+        """
+        limiter = RequestWeightLimiter(self.config.RATIO_ADJUST_INIT_WEIGHT_BUDGET)
+        weight = historical_klines_request_weight(limit, limit)
+
+        def fetch(symbol: str) -> np.ndarray:
+            limiter.acquire(weight)
+            try:
+                klines = self.manager.binance_client.get_historical_klines(
+                    f"{symbol}{self.config.BRIDGE_SYMBOL}", "1m", start_date_str, end_date_str, limit=limit
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.warning(f"Could not fetch the price history of {symbol}: {e}")
+                return np.array([])
+            return np.array([float(result[1]) for result in klines])
+
+        symbols = list(symbols)
+        with ThreadPoolExecutor(max_workers=self.config.RATIO_ADJUST_INIT_THREADS) as executor:
+            return dict(zip(symbols, executor.map(fetch, symbols)))
@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+from typing import Any, Deque, List, Optional, Tuple
+
+# kinds of the queued stream events
+STREAM_SIGNAL = "signal"
+STREAM_DATA = "data"
+
+
+class StreamEventQueue:
+    """
+    Hands the data and the signals of the websocket streams over to a stream processor.
+
+    The websocket manager calls put_data and put_signal from its stream threads. The processor blocks in drain
+    until there is something new, and gets everything that arrived since its last drain in one batch, in the
+    order it arrived. After close, drain returns the rest once and then None.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events: Deque[Tuple[str, Any]] = deque()
+        self.closed = False
+
+    def put_data(self, stream_data, stream_buffer_name=False):  # pylint: disable=unused-argument
+        with self._condition:
+            self._events.append((STREAM_DATA, stream_data))
+            self._condition.notify()
+
+    def put_signal(self, signal_type, stream_id, data_record=False):  # pylint: disable=unused-argument
+        with self._condition:
+            self._events.append((STREAM_SIGNAL, {"type": signal_type, "stream_id": stream_id}))
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> Optional[List[Tuple[str, Any]]]:
+        """
+        Block until events arrived or timeout passed and return them, oldest first. None once closed and drained
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self.closed, timeout)
+            if not self._events:
+                return None if self.closed else []
+            events = list(self._events)
+            self._events.clear()
+            return events
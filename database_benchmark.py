@@ -0,0 +1,564 @@
+import getopt
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Union
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql.expression import and_
+
+from binance_trade_bot.auto_trader import AutoTrader
+from binance_trade_bot.config import Config
+from binance_trade_bot.database import Database
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.models import (
+    Coin,
+    CoinValue,
+    CurrentCoin,
+    Interval,
+    Pair,
+    ScoutHistory,
+    ScoutHistoryRollup,
+    Trade,
+    TradeState,
+)
+from binance_trade_bot.price_board import PRICE_BID, PRICE_LAST, PriceBoard
+from binance_trade_bot.schema import VERSION_1_INDEXED_TABLES, set_schema_version
+from binance_trade_bot.strategies.db_reset_strategy import Strategy as DbResetStrategy
+
+
+class BenchmarkManager:
+    """
+    Stands in for the BinanceAPIManager: fixed random prices for the benchmark coins, no API access
+    """
+
+    def __init__(self, symbols: List[str], bridge_symbol: str, seed=0):
+        rnd = random.Random(seed)
+        self.prices = {symbol + bridge_symbol: rnd.uniform(0.001, 1000) for symbol in symbols}
+        self.price_board = PriceBoard()
+        with self.price_board.write():
+            for ticker_symbol, price in self.prices.items():
+                slot = self.price_board.slot(ticker_symbol)
+                self.price_board.set_last(slot, price)
+                self.price_board.set_book(slot, price * 0.999, price)
+
+    def get_buy_price(self, ticker_symbol: str):
+        return self.prices.get(ticker_symbol)
+
+    def get_sell_price(self, ticker_symbol: str):
+        price = self.prices.get(ticker_symbol)
+        return None if price is None else price * 0.999
+
+    def get_price_board_slot(self, ticker_symbol: str):
+        return self.price_board.slot(ticker_symbol)
+
+    def get_price_board_sequence(self):
+        return self.price_board.sequence
+
+    def get_buy_prices(self, board_slots):
+        return self.price_board.read(PRICE_LAST, board_slots)
+
+    def get_sell_prices(self, board_slots):
+        return self.price_board.read(PRICE_BID, board_slots)
+
+    def get_ticker_price(self, ticker_symbol: str):
+        return self.prices.get(ticker_symbol)
+
+    def get_fees_version(self):
+        return 0
+
+
+class BenchmarkTrader(AutoTrader):
+    re_initialize_trade_thresholds = DbResetStrategy.re_initialize_trade_thresholds
+
+
+class LegacyBenchmarkTrader(AutoTrader):
+    """
+    The trade threshold writes as they were before they became set based, one ORM update per pair. A frozen copy
+    of the old code, the before of the comparison: it doesn't follow later changes of the bot
+    """
+
+    def update_trade_threshold(self, coin: Coin, coin_price: float):
+        session: Session
+        with self.db.db_session() as session:
+            for pair in session.query(Pair).filter(Pair.to_coin == coin):
+                from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
+
+                if from_coin_price is None:
+                    self.logger.info(
+                        "Skipping update for coin {} not found".format(pair.from_coin + self.config.BRIDGE)
+                    )
+                    continue
+
+                pair.ratio = from_coin_price / coin_price
+                pair.from_coin_price = from_coin_price
+                pair.to_coin_price = coin_price
+
+    def initialize_trade_thresholds(self):
+        session: Session
+        with self.db.db_session() as session:
+            pairs = session.query(Pair).filter(Pair.ratio.is_(None)).all()
+            grouped_pairs = defaultdict(list)
+            for pair in pairs:
+                if pair.from_coin.enabled and pair.to_coin.enabled:
+                    grouped_pairs[pair.from_coin.symbol].append(pair)
+            for from_coin_symbol, group in grouped_pairs.items():
+                self.logger.info(f"Initializing {from_coin_symbol} vs [{', '.join([p.to_coin.symbol for p in group])}]")
+                for pair in group:
+                    if pair.from_coin == self.config.BRIDGE:
+                        continue
+                    from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
+                    if from_coin_price is None:
+                        self.logger.info(
+                            "Skipping initializing {}, symbol not found".format(pair.from_coin + self.config.BRIDGE)
+                        )
+                        continue
+
+                    to_coin_price = self.manager.get_buy_price(pair.to_coin + self.config.BRIDGE)
+                    if to_coin_price is None:
+                        self.logger.info(
+                            "Skipping initializing {}, symbol not found".format(pair.to_coin + self.config.BRIDGE)
+                        )
+                        continue
+
+                    pair.ratio = from_coin_price / to_coin_price
+                    pair.from_coin_price = from_coin_price
+                    pair.to_coin_price = to_coin_price
+
+    def re_initialize_trade_thresholds(self):
+        session: Session
+        with self.db.db_session() as session:
+            c1 = aliased(Coin)
+            c2 = aliased(Coin)
+            for pair in (
+                session.query(Pair)
+                .join(c1, and_(Pair.from_coin_id == c1.symbol, c1.enabled.is_(True)))
+                .join(c2, and_(Pair.to_coin_id == c2.symbol, c2.enabled.is_(True)))
+                .all()
+            ):
+                self.logger.info(f"Initializing {pair.from_coin} vs {pair.to_coin}", False)
+
+                from_coin_price = self.manager.get_sell_price(pair.from_coin + self.config.BRIDGE)
+                if from_coin_price is None:
+                    continue
+
+                to_coin_price = self.manager.get_buy_price(pair.to_coin + self.config.BRIDGE)
+                if to_coin_price is None:
+                    continue
+
+                pair.ratio = from_coin_price / to_coin_price
+                pair.from_coin_price = from_coin_price
+                pair.to_coin_price = to_coin_price
+
+
+class BenchmarkDatabase(Database):
+    def seed_coins(self, symbols: List[str]):
+        """
+        Add the coins and all the pairs between them, without going through the ORM one row at a time
+        """
+        session: Session
+        with self.db_session() as session:
+            session.execute(insert(Coin.__table__), [{"symbol": symbol, "enabled": True} for symbol in symbols])
+            session.execute(
+                insert(Pair.__table__),
+                [
+                    {"from_coin_id": from_symbol, "to_coin_id": to_symbol}
+                    for from_symbol in symbols
+                    for to_symbol in symbols
+                    if from_symbol != to_symbol
+                ],
+            )
+
+    def reset_pair_ratios(self):
+        session: Session
+        with self.db_session() as session:
+            session.execute(update(Pair.__table__).values(ratio=None, from_coin_price=None, to_coin_price=None))
+        self.model_cache.invalidate_pairs()
+
+    def get_pair_ratios(self):
+        session: Session
+        with self.db_session() as session:
+            return session.execute(
+                select([Pair.id, Pair.ratio, Pair.from_coin_price, Pair.to_coin_price]).order_by(Pair.id)
+            ).fetchall()
+
+
+class LegacyBenchmarkDatabase(BenchmarkDatabase):
+    """
+    Reads and prunes the scout history the way the bot did before it was partitioned, from a single table. A
+    frozen copy of the old code like LegacyBenchmarkTrader
+    """
+
+    def get_scout_history(self, coin: Union[Coin, str], since: Optional[datetime] = None) -> List[ScoutHistory]:
+        coin_symbol = coin.symbol if isinstance(coin, Coin) else coin
+        session: Session
+        with self.db_session() as session:
+            query = (
+                session.query(ScoutHistory)
+                .join(ScoutHistory.pair)
+                .filter(Pair.from_coin_id == coin_symbol)
+                .order_by(ScoutHistory.datetime.asc())
+            )
+            if since is not None:
+                query = query.filter(ScoutHistory.datetime >= since)
+            scouts = query.all()
+            # the api server serialized them inside the session, loading the pairs and coins lazily
+            for scout in scouts:
+                scout.info()
+            session.expunge_all()
+            return scouts
+
+    def prune_scout_history(self):
+        time_diff = datetime.now() - timedelta(hours=self.config.SCOUT_HISTORY_PRUNE_TIME)
+        session: Session
+        with self.db_session() as session:
+            if self.config.SCOUT_HISTORY_MODE == Config.SCOUT_HISTORY_MODE_COMPACT:
+                session.query(ScoutHistoryRollup).filter(ScoutHistoryRollup.datetime < time_diff).delete()
+                time_diff = datetime.now() - timedelta(minutes=self.config.SCOUT_HISTORY_RAW_MINUTES)
+            session.query(ScoutHistory).filter(ScoutHistory.datetime < time_diff).delete()
+
+
+def _timed(run: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def benchmark_threshold_writes(
+    trader: AutoTrader, db: BenchmarkDatabase, updated_coins: List[Coin], manager: BenchmarkManager
+) -> Dict[str, float]:
+    """
+    Seconds the trader takes to initialize, update and re-initialize the trade thresholds of all the pairs
+    """
+    db.reset_pair_ratios()
+    timings = {"initialize": _timed(trader.initialize_trade_thresholds)}
+
+    def update_all():
+        for coin in updated_coins:
+            trader.update_trade_threshold(coin, manager.get_buy_price(coin + trader.config.BRIDGE))
+
+    timings["update"] = _timed(update_all) / len(updated_coins)
+    timings["re-initialize"] = _timed(trader.re_initialize_trade_thresholds)
+    return timings
+
+
+def benchmark_trade_threshold_writes(
+    coin_counts: List[int], updated_coins: int, config: Config, logger: Logger
+) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    Compare the per-pair ORM threshold writes against the set based ones on a sqlite file database
+
+    :return: coin count -> "before"/"after" -> operation -> seconds
+    """
+
+    results = {}
+    for coin_count in coin_counts:
+        symbols = [f"COIN{i}" for i in range(coin_count)]
+        manager = BenchmarkManager(symbols, config.BRIDGE.symbol)
+
+        with tempfile.TemporaryDirectory() as db_dir:
+            db = BenchmarkDatabase(logger, config, f"sqlite:///{os.path.join(db_dir, 'writes.db')}", True)
+            db.create_database()
+            db.seed_coins(symbols)
+            coins = [db.get_coin(symbol) for symbol in symbols[:updated_coins]]
+
+            # the per-pair logging is the same for both, it isn't what is measured here
+            log_level = logger.Logger.level
+            logger.Logger.setLevel(logging.WARNING)
+            try:
+                legacy_trader = LegacyBenchmarkTrader(manager, db, logger, config)
+                before = benchmark_threshold_writes(legacy_trader, db, coins, manager)
+                before_ratios = db.get_pair_ratios()
+                after = benchmark_threshold_writes(BenchmarkTrader(manager, db, logger, config), db, coins, manager)
+                after_ratios = db.get_pair_ratios()
+            finally:
+                logger.Logger.setLevel(log_level)
+            db.engine.dispose()
+
+        if before_ratios != after_ratios:
+            logger.warning(f"{coin_count} coins: the set based writes didn't write the same ratios", False)
+        results[coin_count] = {"before": before, "after": after}
+        for operation in before:
+            logger.info(
+                f"{coin_count} coins, {coin_count * (coin_count - 1)} pairs, {operation}: "
+                f"{before[operation]:.3f}s before, {after[operation]:.3f}s after, "
+                f"{before[operation] / after[operation]:.1f}x",
+                False,
+            )
+    return results
+
+
+def _legacy_schema(db: BenchmarkDatabase):
+    """
+    Take the database back to the schema before version 1, with the scout history in a single table, without the
+    indexes and the version
+    """
+    with db.engine.begin() as connection:
+        ScoutHistory.__table__.create(connection, checkfirst=True)
+        for table in VERSION_1_INDEXED_TABLES:
+            for index in table.indexes:
+                index.drop(connection, checkfirst=True)
+        set_schema_version(connection, 0)
+
+
+def _pruned_interval(hours_ago: int) -> Interval:
+    if hours_ago % (7 * 24) == 0:
+        return Interval.WEEKLY
+    if hours_ago % 24 == 0:
+        return Interval.DAILY
+    return Interval.HOURLY
+
+
+def _seed_month(db: BenchmarkDatabase, symbols: List[str], days: int, config: Config):
+    """
+    Fill the database the way the bot leaves it after running for days: a coin jump every half an hour, the
+    value history of every coin, as they all keep some dust, as pruned every hour, and the scout history of
+    the prune window plus the minute the next prune removes, one scout of the current coin every
+    SCOUT_SLEEP_TIME seconds
+    """
+    rnd = random.Random(0)
+    now = datetime.now().replace(second=0, microsecond=0)
+    start = now - timedelta(days=days)
+    jumps = [start + timedelta(minutes=30 * k) for k in range(days * 48)]
+    current_symbols = [rnd.choice(symbols) for _ in jumps]
+
+    session: Session
+    with db.db_session() as session:
+        # the bridge is added disabled by the first trade
+        session.execute(insert(Coin.__table__), [{"symbol": config.BRIDGE.symbol, "enabled": False}])
+        session.execute(
+            insert(CurrentCoin.__table__),
+            [{"coin_id": symbol, "datetime": dt} for symbol, dt in zip(current_symbols, jumps)],
+        )
+        session.execute(
+            insert(Trade.__table__),
+            [
+                {
+                    "alt_coin_id": symbol,
+                    "crypto_coin_id": config.BRIDGE.symbol,
+                    "selling": selling,
+                    "state": TradeState.COMPLETE,
+                    "alt_starting_balance": rnd.uniform(0, 100),
+                    "alt_trade_amount": rnd.uniform(0, 100),
+                    "crypto_starting_balance": rnd.uniform(0, 100),
+                    "crypto_trade_amount": rnd.uniform(0, 100),
+                    "datetime": dt + timedelta(seconds=selling),
+                }
+                for symbol, dt in zip(current_symbols, jumps)
+                for selling in (True, False)
+            ],
+        )
+
+        # minutely values for the last 25 hours, the hour before the next prune included, hourly ones before
+        value_times = [(now - timedelta(minutes=m), Interval.MINUTELY) for m in range(25 * 60, 0, -1)]
+        value_times[:0] = [(now - timedelta(hours=h), _pruned_interval(h)) for h in range(days * 24, 25, -1)]
+        session.execute(
+            insert(CoinValue.__table__),
+            [
+                {
+                    "coin_id": symbol,
+                    "balance": rnd.uniform(0, 100),
+                    "usd_price": rnd.uniform(0, 100),
+                    "btc_price": rnd.uniform(0, 1),
+                    "interval": interval,
+                    "datetime": dt,
+                }
+                for symbol in symbols
+                for dt, interval in value_times
+            ],
+        )
+
+        pairs = session.query(Pair.id, Pair.from_coin_id).all()
+    pair_ids = defaultdict(list)
+    for pair_id, from_coin_symbol in pairs:
+        pair_ids[from_coin_symbol].append(pair_id)
+
+    scout_time = now - timedelta(hours=config.SCOUT_HISTORY_PRUNE_TIME, minutes=1)
+    while scout_time < now:
+        # a minute of scouts per transaction, into the single table the bot wrote them to before version 4
+        rows = []
+        for _ in range(max(1, int(60 / config.SCOUT_SLEEP_TIME))):
+            current_symbol = current_symbols[-1]
+            rows.extend(
+                {
+                    "pair_id": pair_id,
+                    "target_ratio": rnd.uniform(0, 100),
+                    "current_coin_price": rnd.uniform(0, 100),
+                    "other_coin_price": rnd.uniform(0.1, 100),
+                    "datetime": scout_time,
+                }
+                for pair_id in pair_ids[current_symbol]
+            )
+            scout_time += timedelta(seconds=config.SCOUT_SLEEP_TIME)
+        with db.db_session() as session:
+            session.execute(insert(ScoutHistory.__table__), rows)
+            if config.SCOUT_HISTORY_MODE == Config.SCOUT_HISTORY_MODE_COMPACT:
+                db._rollup_scout_history(session, rows)  # pylint: disable=protected-access
+
+
+def _timed_median(run: Callable[[], None], repeats: int) -> float:
+    return sorted(_timed(run) for _ in range(repeats))[repeats // 2]
+
+
+def _benchmark_query_set(db: BenchmarkDatabase, symbols: List[str], repeats: int) -> Dict[str, float]:
+    """
+    Seconds the api server endpoints and the bot's lookups take, median of repeats, then the prunes
+    """
+    from binance_trade_bot import api_server  # pylint: disable=import-outside-toplevel
+
+    api_server.db = db
+    api_server.config = db.config
+
+    def api(path: str, view: Callable, **kwargs):
+        def run():
+            with api_server.app.test_request_context(path):
+                view(**kwargs)
+
+        return run
+
+    queries = {
+        "api value_history": api("/api/value_history", api_server.value_history),
+        "api value_history 1d of a coin": api(
+            "/api/value_history?period=1d", api_server.value_history, coin=symbols[0]
+        ),
+        "api total_value_history 1w": api("/api/total_value_history?period=1w", api_server.total_value_history),
+        "api trade_history 1w": api("/api/trade_history?period=1w", api_server.trade_history),
+        "api scouting_history 1h": api("/api/scouting_history?period=1h", api_server.scouting_history),
+        "api current_coin_history 1d": api("/api/current_coin_history?period=1d", api_server.current_coin_history),
+        "current coin": db.get_current_coin,
+        "pair lookup": lambda: db.get_pair(symbols[1], symbols[2]),
+    }
+    timings = {name: _timed_median(run, repeats) for name, run in queries.items()}
+    timings["prune_scout_history"] = _timed(db.prune_scout_history)
+    timings["prune_value_history"] = _timed(db.prune_value_history)
+    return timings
+
+
+def benchmark_queries(
+    coin_count: int, days: int, repeats: int, config: Config, logger: Logger
+) -> Dict[str, Dict[str, float]]:
+    """
+    Seed a month of data into a database without indexes and time the queries before and after the upgrade
+
+    :return: "before"/"after" -> query -> seconds
+    """
+    symbols = [f"COIN{i}" for i in range(coin_count)]
+    with tempfile.TemporaryDirectory() as db_dir:
+        before_path = os.path.join(db_dir, "before.db")
+        after_path = os.path.join(db_dir, "after.db")
+
+        db = LegacyBenchmarkDatabase(logger, config, f"sqlite:///{before_path}", True, cache_models=False)
+        db.create_database()
+        _legacy_schema(db)
+        db.seed_coins(symbols)
+        logger.info(f"Seeding {days} days of data and {config.SCOUT_HISTORY_PRUNE_TIME} hours of scout history", False)
+        _seed_month(db, symbols, days, config)
+        db.engine.dispose()
+        shutil.copyfile(before_path, after_path)
+
+        before = _benchmark_query_set(db, symbols, repeats)
+        db.engine.dispose()
+
+        db = BenchmarkDatabase(logger, config, f"sqlite:///{after_path}", True, cache_models=False)
+        upgrade_time = _timed(db.create_database)
+        after = _benchmark_query_set(db, symbols, repeats)
+        db.engine.dispose()
+
+    logger.info(f"Schema upgrade: {upgrade_time:.3f}s", False)
+    for query in before:
+        logger.info(
+            f"{query}: {before[query] * 1000:.1f}ms before, {after[query] * 1000:.1f}ms after, "
+            f"{before[query] / after[query]:.1f}x",
+            False,
+        )
+    return {"before": before, "after": after}
+
+
+def benchmark_database(
+    coin_counts: List[int] = None,
+    updated_coins=5,
+    query_coin_count=30,
+    days=30,
+    repeats=5,
+    benchmarks: List[str] = None,
+    config: Config = None,
+):
+    """
+    Benchmark the database: the trade threshold writes and the queries of the bot and the api server
+
+    :param coin_counts: Numbers of coins to benchmark the writes with, every coin is paired with every other one
+    :param updated_coins: Number of coins update_trade_threshold is timed with, the average is reported
+    :param query_coin_count: Number of coins of the database the queries are benchmarked on
+    :param days: Days of history to seed for the queries, the scout history covers hourToKeepScoutHistory
+    :param repeats: How often every query is run, the median is reported
+    :param benchmarks: Which benchmarks to run, "writes" and/or "queries". Default: both
+    :param config: Configuration object to use
+
+    :return: benchmark -> its results
+    """
+    config = config or Config()
+    logger = Logger("benchmark", enable_notifications=False)
+    benchmarks = benchmarks or ["writes", "queries"]
+
+    results = {}
+    if "writes" in benchmarks:
+        results["writes"] = benchmark_trade_threshold_writes(
+            coin_counts or [100, 300, 600], updated_coins, config, logger
+        )
+    if "queries" in benchmarks:
+        results["queries"] = benchmark_queries(query_coin_count, days, repeats, config, logger)
+    return results
+
+
+def OK():
+    if os.name == "nt":
+        return 0
+    return os.EX_OK
+
+
+def usage():
+    print(
+        "database_benchmark.py - Script to measure the database write time of the trade thresholds and the query "
+        "latencies"
+    )
+    print("parameters:")
+    print(
+        "-c, --coincounts <optional, numbers of coins to benchmark the writes with, e.g '100 300 600', if not given "
+        "100, 300 and 600 will be used>"
+    )
+    print(
+        "-b, --benchmarks <optional, benchmarks to run, 'writes' and/or 'queries', if not given both will be run>"
+    )
+    print("-d, --days <optional, days of history to seed for the queries, if not given 30 will be used>")
+
+
+if __name__ == "__main__":
+    coin_counts = None
+    benchmarks = None
+    days = 30
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hc:b:d:", ["coincounts=", "benchmarks=", "days="])
+    except getopt.GetoptError as e:
+        print(e)
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            usage()
+            os._exit(OK())
+        elif opt in ("-c", "--coincounts"):
+            coin_counts = [int(count) for count in arg.split()]
+        elif opt in ("-b", "--benchmarks"):
+            benchmarks = arg.split()
+        elif opt in ("-d", "--days"):
+            days = int(arg)
+
+    benchmark_database(coin_counts, days=days, benchmarks=benchmarks)
+    os._exit(OK())